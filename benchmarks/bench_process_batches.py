@@ -0,0 +1,68 @@
+"""
+Throughput of a PromiseProcessPool for tiny and large promises, sent one
+by one, micro-batched and in chunks.
+
+Usage: `python benchmarks/bench_process_batches.py -n 5000 --pool-size 4`
+"""
+import argparse
+import threading
+import time
+
+from prompy.processio.process_containers import PromiseProcessPool
+from prompy.processio.process_promise import ProcessPromise
+
+
+def _tiny(resolve, _):
+    resolve(None)
+
+
+def _large(resolve, _):
+    resolve(sum(i * i for i in range(50000)))
+
+
+def run(starter, num_promises: int, pool_size: int, mode: str) -> float:
+    """Run num_promises, return the promises settled per second."""
+    options = {'batch_size': 64} if mode == 'batched' else {}
+    pool = PromiseProcessPool(pool_size=pool_size, **options)
+    done = threading.Semaphore(0)
+    promises = []
+    for _ in range(num_promises):
+        promise = ProcessPromise(starter)
+        promise.proxy.complete(lambda *_: done.release())
+        promises.append(promise)
+    # the workers are started before the clock.
+    warmup = ProcessPromise(_tiny)
+    warmup.proxy.complete(lambda *_: done.release())
+    pool.add_promise(warmup)
+    done.acquire()
+
+    started = time.perf_counter()
+    if mode == 'chunked':
+        pool.add_promises(*promises)
+    else:
+        for promise in promises:
+            pool.add_promise(promise)
+        pool.flush()
+    for _ in range(num_promises):
+        done.acquire()
+    elapsed = time.perf_counter() - started
+    pool.shutdown()
+    return num_promises / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--num-promises', type=int, default=5000)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--modes', nargs='+', default=['single', 'batched', 'chunked'])
+    args = parser.parse_args()
+
+    for name, starter, num_promises in (('tiny', _tiny, args.num_promises),
+                                        ('large', _large, max(args.num_promises // 10, 1))):
+        for mode in args.modes:
+            rate = run(starter, num_promises, args.pool_size, mode)
+            print(f'{name} {mode}: {rate:.0f} promises/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Throughput of a PromiseQueue thread and of a PromiseQueuePool.
+
+Usage: `python benchmarks/bench_promise_queue.py -n 2000 --pool-size 4`
+"""
+import argparse
+import threading
+import time
+
+from prompy.promise import Promise
+from prompy.threadio.promise_queue import PromiseQueue, PromiseQueuePool
+
+
+def _noop(resolve, _):
+    resolve(None)
+
+
+def run(container, num_promises: int) -> float:
+    """Add num_promises, return the promises per second once all resolved."""
+    remaining = [num_promises]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def _then(_):
+        with lock:
+            remaining[0] -= 1
+            if not remaining[0]:
+                done.set()
+
+    started = time.perf_counter()
+    for _ in range(num_promises):
+        container.add_promise(Promise(_noop, then=_then))
+    done.wait()
+    return num_promises / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--num-promises', type=int, default=2000)
+    parser.add_argument('--pool-size', type=int, default=4)
+    args = parser.parse_args()
+
+    queue = PromiseQueue(start=True, daemon=True)
+    print(f'PromiseQueue: {run(queue, args.num_promises):.0f} promises/s')
+    queue.stop()
+
+    pool = PromiseQueuePool(pool_size=args.pool_size, start=True, daemon=True)
+    print(f'PromiseQueuePool({args.pool_size}): '
+          f'{run(pool, args.num_promises):.0f} promises/s')
+
+
+if __name__ == '__main__':
+    main()
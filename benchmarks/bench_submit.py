@@ -0,0 +1,57 @@
+"""
+Submission throughput of a PromiseQueuePool as the producer threads grow.
+
+Usage: `python benchmarks/bench_submit.py -n 20000 --producers 1 2 4 8 16 32`
+"""
+import argparse
+import threading
+import time
+
+from prompy.promise import Promise
+from prompy.threadio.promise_queue import PromiseQueuePool
+
+
+def _noop(resolve, _):
+    resolve(None)
+
+
+def run(pool: PromiseQueuePool, num_promises: int, num_producers: int) -> float:
+    """Submit num_promises from num_producers threads, return the submissions per second."""
+    per_producer = num_promises // num_producers
+    promises = [[Promise(_noop) for _ in range(per_producer)]
+                for _ in range(num_producers)]
+    barrier = threading.Barrier(num_producers + 1)
+
+    def _produce(batch):
+        barrier.wait()
+        for promise in batch:
+            pool.add_promise(promise)
+
+    producers = [threading.Thread(target=_produce, args=(batch,)) for batch in promises]
+    for producer in producers:
+        producer.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for producer in producers:
+        producer.join()
+    elapsed = time.perf_counter() - started
+    while pool.stats().backlog:
+        time.sleep(0.01)
+    return per_producer * num_producers / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--num-promises', type=int, default=20000)
+    parser.add_argument('--producers', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--pool-size', type=int, default=4)
+    args = parser.parse_args()
+
+    pool = PromiseQueuePool(pool_size=args.pool_size, start=True, daemon=True)
+    for num_producers in args.producers:
+        print(f'{num_producers} producers: '
+              f'{run(pool, args.num_promises, num_producers):.0f} submissions/s')
+
+
+if __name__ == '__main__':
+    main()
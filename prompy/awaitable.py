@@ -30,14 +30,17 @@ Promise you can await.
 
 """
 import asyncio
+import functools
 
 from typing import Any
 
+from prompy import microtask
+from prompy.cancel import CancelToken
 from prompy.container import BasePromiseRunner
-from prompy.errors import UnhandledPromiseError
 from prompy.promise import Promise, CompleteCallback,\
     CatchCallback, ThenCallback, PromiseStarter, PromiseState
 from prompy.promtools import promise_wrap
+from prompy.timers import get_timer_service
 
 
 class AwaitablePromise(Promise):
@@ -46,106 +49,136 @@ class AwaitablePromise(Promise):
 
     Await it to get the result.
     Need a running loop to actually start the executor.
+
+    Callbacks are run from the loop, coroutines returned by callbacks
+    are awaited before settling the derived promise.
     """
+    __slots__ = ('loop', '_future')
 
     def __init__(self, starter: PromiseStarter,
                  then: ThenCallback = None,
                  catch: CatchCallback = None,
                  complete: CompleteCallback = None,
-                 loop: asyncio.AbstractEventLoop=None):
+                 loop: asyncio.AbstractEventLoop=None,
+                 timeout: float = None,
+                 deadline: float = None,
+                 cancel_token: CancelToken = None):
+        self.loop = loop or asyncio.get_event_loop()
+        self._future: asyncio.Future = None
         super().__init__(starter, then, catch, complete,
                          raise_again=False,
-                         start_now=False)
-        self.loop = loop or asyncio.get_event_loop()
-        self.future: asyncio.Future = self.loop.create_future()
+                         start_now=False,
+                         timeout=timeout,
+                         deadline=deadline,
+                         cancel_token=cancel_token)
         self.loop.call_soon_threadsafe(self.exec)
 
-    def resolve(self, result: Any):
-        self._result = result
-        self._results.append(result)
-
-        if not self._then:
-            return self._finish(PromiseState.fulfilled)
-
-        for t in self._then:
-            self._ensure_awaited(t(result),
-                                 callback=self._done(
-                                     self._finish,
-                                     PromiseState.fulfilled,
-                                     len(self._then)))
-
-    def reject(self, error: Exception):
-        self._error = error
-
-        if not self._catch:
-            self._state = PromiseState.rejected
-            raise UnhandledPromiseError(
-                f"Unhandled promise exception: {self.id}") from error
-
-        for catcher in self._catch:
-            self._ensure_awaited(catcher(error),
-                                 callback=self._done(
-                                     self._finish,
-                                     PromiseState.fulfilled,
-                                     len(self._catch)))
-
-    def _finish(self, state):
-        if not self._complete:
-            self._on_complete(state)
-
-        for c in self._complete:
-            self._ensure_awaited(c(self.result, self._error),
-                                 callback=self._done(
-                                     self._on_complete,
-                                     state,
-                                     len(self._complete)))
-
-    def _on_complete(self, state):
-        if self._error:
-            self.future.set_exception(self._error)
+    def _derive(self):
+        derived = type(self).deferred(results_buffer_size=self._results_buffer_size,
+                                      loop=self.loop)
+        derived._token = self._token
+        return derived
+
+    @classmethod
+    def deferred(cls, results_buffer_size: int=100,
+                 loop: asyncio.AbstractEventLoop=None,
+                 cancel_token: CancelToken=None, **kwargs):
+        promise = super().deferred(results_buffer_size)
+        promise.loop = loop or asyncio.get_event_loop()
+        promise._future = None
+        if cancel_token is not None:
+            promise._bind_token(cancel_token)
+        return promise
+
+    def _timers(self):
+        return get_timer_service(self.loop)
+
+    def _schedule(self, func, *args):
+        microtask.get_loop_queue(self.loop).enqueue(func, *args)
+
+    def _settle(self, state, value, abandon=False):
+        if not super()._settle(state, value, abandon):
+            return False
+        if self._future is not None:
+            # might be settled from another thread, sync on the loop.
+            self._schedule(self._sync_future)
+        return True
+
+    def _sync_future(self):
+        if not self._future.done():
+            self._set_future(self._future)
+
+    def _set_future(self, future: asyncio.Future):
+        if self._state == PromiseState.rejected:
+            future.set_exception(self._error)
         else:
-            self.future.set_result(self.result)
-        self._state = state
-
-    def _done(self, on_finish, state, to_do):
-        done = asyncio.Queue(loop=self.loop)
+            future.set_result(self.result)
 
-        def _done(*args, **kwargs):
-            done.put_nowait(1)
-            if done.qsize() == to_do:
-                on_finish(state)
+    def _observed(self):
+        # Awaiting the promise is handling its rejection.
+        return self._future is not None
 
-        return _done
-
-    def __await__(self):
-        while not self.future.done():
-            yield from self.future
-        return self.future.result()
+    def _resolve_derived(self, derived, returned):
+        if asyncio.iscoroutine(returned) or asyncio.isfuture(returned):
+            task = asyncio.ensure_future(returned, loop=self.loop)
+            task.add_done_callback(
+                functools.partial(_settle_from_future, derived))
+        else:
+            super()._resolve_derived(derived, returned)
 
     def callback_handler(self, obj: Any):
-        self._ensure_awaited(obj)
-
-    def _ensure_awaited(self, obj, callback=None):
         if asyncio.iscoroutine(obj):
             task = self.loop.create_task(obj)
-            if callback:
-                task.add_done_callback(callback)
-        elif callback:
-            callback()
+            task.add_done_callback(self._callback_done)
+            return None
+        return super().callback_handler(obj)
+
+    def _callback_done(self, task: asyncio.Future):
+        if task.cancelled() or task.exception() is None:
+            return
+        if self._state == PromiseState.pending:
+            # The starter coroutine failed before settling.
+            self.reject(task.exception())
+        else:
+            self.loop.call_exception_handler({
+                'message': f'Exception in promise callback {task!r}',
+                'exception': task.exception(),
+            })
+
+    @property
+    def future(self) -> asyncio.Future:
+        """The future to await, created on demand."""
+        if self._future is None:
+            future = self.loop.create_future()
+            if self._state != PromiseState.pending:
+                self._set_future(future)
+            self._future = future
+        return self._future
+
+    def __await__(self):
+        return self.future.__await__()
 
     @property
     def error(self):
         """
-        :raise: invalid state if the promise was not completed.
         :return: the exception or the handled error
         """
-        return self.future.exception() or self._error
+        return self._error
 
     @staticmethod
     def wrap(func):
         return promise_wrap(func, prom_type=AwaitablePromise)
 
 
+def _settle_from_future(promise: Promise, future: asyncio.Future):
+    if future.cancelled():
+        promise.reject(asyncio.CancelledError())
+    elif future.exception() is not None:
+        promise.reject(future.exception())
+    else:
+        promise.resolve(future.result())
+
+
 class AsyncPromiseRunner(BasePromiseRunner):
     """Run the loop forever"""
 
@@ -0,0 +1,82 @@
+"""
+Bounded promise queues.
+
+A queue with a `capacity` applies its :py:class:`OverflowPolicy` when full:
+
+* block - the producer waits for a free slot (up to `block_timeout`).
+* reject - `add_promise` raises a :py:class:`~prompy.errors.PromiseOverloadError`.
+* drop_oldest - the queued promise that would run first (fifo) or last
+  (priority and deadline schedulers) is dropped to make room.
+
+Independently, promises that waited longer than `max_wait` in the queue
+are shed instead of started.
+
+Refused, dropped and shed promises are canceled and rejected with a
+:py:class:`~prompy.errors.PromiseOverloadError`.
+"""
+import enum
+import threading
+import time
+from typing import NamedTuple, Callable, Optional
+
+from prompy.errors import PromiseOverloadError
+
+
+class OverflowPolicy(enum.Enum):
+    block = 'block'
+    reject = 'reject'
+    drop_oldest = 'drop_oldest'
+
+
+class QueueLimits(NamedTuple):
+    """Limits of a promise queue, unbounded by default."""
+    capacity: int = 0
+    overflow: OverflowPolicy = OverflowPolicy.block
+    block_timeout: Optional[float] = None
+    max_wait: Optional[float] = None
+
+
+class Capacity:
+    """
+    Slots of a bounded queue, acquired by the producers and released
+    when the promise is taken out of the queue.
+    """
+    __slots__ = ('limits', '_semaphore')
+
+    def __init__(self, limits: QueueLimits = None, semaphore_factory: Callable = threading.Semaphore):
+        """
+        :param limits:
+        :param semaphore_factory: `multiprocessing.Semaphore` for queues between processes.
+        """
+        self.limits = limits = limits or QueueLimits()
+        self._semaphore = semaphore_factory(limits.capacity) if limits.capacity > 0 else None
+
+    def acquire(self, evict: Callable[[], bool] = None):
+        """
+        Take a slot for a new promise, apply the overflow policy if full.
+
+        :param evict: remove a queued promise for drop_oldest, its slot is
+            given to the new promise. False if nothing could be removed.
+        :return:
+        """
+        semaphore = self._semaphore
+        if semaphore is None or semaphore.acquire(False):
+            return
+        overflow = OverflowPolicy(self.limits.overflow)
+        if overflow == OverflowPolicy.block:
+            if semaphore.acquire(timeout=self.limits.block_timeout):
+                return
+        elif overflow == OverflowPolicy.drop_oldest:
+            if evict is not None and evict():
+                return
+        raise PromiseOverloadError(f"Queue is full ({self.limits.capacity} promises)")
+
+    def release(self):
+        """Free the slot of a promise taken out of the queue."""
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def expired(self, enqueued: float) -> bool:
+        """The promise queued at `enqueued` (`time.monotonic`) waited too long."""
+        max_wait = self.limits.max_wait
+        return max_wait is not None and time.monotonic() - enqueued > max_wait
@@ -0,0 +1,176 @@
+"""
+Batch and coalesce keyed requests.
+
+:Example:
+
+.. code-block:: python
+
+    from prompy.batcher import PromiseBatcher
+    from prompy.threadio.tpromise import TPromise
+
+    def load_users(user_ids):
+        rep = bulk_lookup(user_ids)  # one call to the backend.
+        return {user['id']: user for user in rep}
+
+    users = PromiseBatcher(load_users, max_batch_size=50, prom_type=TPromise)
+    users.load(1).then(print)
+    users.load(2).then(print)  # same batch as 1.
+
+"""
+import asyncio
+import functools
+import threading
+from typing import Callable, List, Any, Dict, Union, Mapping, Sequence, Iterable
+
+from prompy.awaitable import AwaitablePromise
+from prompy.errors import PromiseError
+from prompy.promise import Promise
+from prompy.promtools import pall
+from prompy.timers import get_timer_service, handoff
+
+BatchFunction = Callable[[List[Any]], Union[Mapping[Any, Any], Sequence[Any]]]
+
+
+def _pick(index, key, results):
+    if isinstance(results, Mapping):
+        value = results[key]
+    else:
+        value = results[index]
+    if isinstance(value, Exception):
+        raise value
+    return value
+
+
+class _Batch:
+    __slots__ = ('keys', 'index', 'source', 'timer')
+
+    def __init__(self, source: Promise):
+        self.keys: List[Any] = []
+        self.index: Dict[Any, Promise] = {}
+        self.source = source
+        self.timer = None
+
+
+class PromiseBatcher:
+    """
+    Collect the keys loaded within a window into a single call to `batch_func`.
+
+    `batch_func` is called with the list of unique keys of the batch and
+    return either a sequence of results in the same order or a mapping of
+    key to result. A result that is an exception reject the promise of its key.
+    """
+
+    def __init__(self, batch_func: BatchFunction,
+                 max_batch_size: int = 100,
+                 window: float = 0.005,
+                 prom_type=Promise,
+                 **kwargs):
+        """
+        :param batch_func: called with the keys of a batch.
+        :param max_batch_size: dispatch the batch right away when it has this many keys.
+        :param window: seconds to wait for more keys after the first of a batch,
+            0 to only dispatch when full or on :py:meth:`dispatch`.
+        :param prom_type: Type of the promises, the batch call is a `prom_type`
+            promise, plain promises are executed by the dispatcher (the thread
+            of the load call that filled the batch or of :py:meth:`dispatch`),
+            on the TPromise pool when the window expires.
+        :param kwargs: kwargs of the promises initializer.
+        """
+        self._batch_func = batch_func
+        self._max_batch_size = max(max_batch_size, 1)
+        self._window = window
+        self._prom_type = prom_type
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._batch: _Batch = None
+        self.num_batches = 0
+
+    def load(self, key) -> Promise:
+        """
+        Load a key with the next batch, the same key is loaded once per batch.
+
+        :param key: hashable key to give to the batch function.
+        :return: A promise resolved with the result for the key.
+        """
+        with self._lock:
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _Batch(
+                    self._prom_type.deferred(**self._kwargs))
+                self._start_window(batch)
+            promise = batch.index.get(key)
+            if promise is None:
+                promise = batch.source.then(
+                    functools.partial(_pick, len(batch.keys), key))
+                batch.index[key] = promise
+                batch.keys.append(key)
+            full = len(batch.keys) >= self._max_batch_size
+            if full:
+                self._batch = None
+        if full:
+            self._dispatch(batch)
+        return promise
+
+    def load_many(self, keys: Iterable) -> Promise:
+        """Load all the keys, resolve with the results in the same order."""
+        promise = pall(*(self.load(key) for key in keys),
+                       prom_type=self._prom_type, **self._kwargs)
+        if type(promise) is Promise:
+            promise.exec()
+        return promise
+
+    def dispatch(self):
+        """Dispatch the current batch without waiting for the window."""
+        with self._lock:
+            batch = self._batch
+            self._batch = None
+        if batch is not None:
+            self._dispatch(batch)
+
+    def _start_window(self, batch: _Batch):
+        if not self._window:
+            return
+        if issubclass(self._prom_type, AwaitablePromise):
+            loop = batch.source.loop
+            loop.call_soon_threadsafe(
+                loop.call_later, self._window, self._dispatch_expired, batch)
+        else:
+            # no thread per window, the dispatch is handed off the timer thread.
+            batch.timer = get_timer_service().call_later(
+                self._window, handoff, self._dispatch_expired, batch)
+
+    def _dispatch_expired(self, batch: _Batch):
+        with self._lock:
+            if self._batch is not batch:
+                return  # already dispatched when it was full.
+            self._batch = None
+        self._dispatch(batch, pooled=True)
+
+    def _dispatch(self, batch: _Batch, pooled: bool = False):
+        if batch.timer is not None:
+            batch.timer.cancel()
+        with self._lock:
+            self.num_batches += 1
+        keys = batch.keys
+
+        def starter(resolve, _):
+            resolve(self._batch_func(keys))
+
+        if asyncio.iscoroutinefunction(self._batch_func):
+            async def starter(resolve, _):
+                resolve(await self._batch_func(keys))
+
+        # callbacks given to the constructor, TPromise can start right away.
+        call = self._prom_type(starter,
+                               then=batch.source.resolve,
+                               catch=batch.source.reject,
+                               **self._kwargs)
+        if type(call) is Promise:
+            if pooled:
+                from prompy.threadio.tpromise import get_pool
+                try:
+                    get_pool().add_promise(call)
+                except PromiseError as error:
+                    batch.source.reject(error)
+            else:
+                call.exec()
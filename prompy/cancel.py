@@ -0,0 +1,101 @@
+"""
+Cooperative cancellation of promises.
+
+:Example:
+
+.. code-block:: python
+
+    from prompy.cancel import CancelToken
+    from prompy.networkio.urlcall import get
+    from prompy.promtools import pall
+    from prompy.threadio.tpromise import TPromise
+
+    token = CancelToken()
+    pages = pall(*(get(url, prom_type=TPromise, cancel_token=token) for url in urls),
+                 prom_type=TPromise)
+    ...
+    token.cancel('not needed anymore')
+
+Promises given a token are canceled with it: they are rejected with a
+:py:class:`~prompy.errors.PromiseCanceledError` and skipped by the
+containers if not started. Running starters are not interrupted, they
+can check the token (or `promise.canceled`) to stop early.
+"""
+import threading
+from typing import Callable, Any, List
+
+from prompy.errors import PromiseCanceledError
+
+CancelCallback = Callable[[Any], None]
+
+
+class CancelToken:
+    """
+    Signal the cancellation to a group of promises and callbacks.
+
+    Callbacks are kept until the token is canceled, use a token per
+    unit of work.
+    """
+    __slots__ = ('_callbacks', '_lock', '_canceled', 'reason')
+
+    def __init__(self, parent: 'CancelToken' = None):
+        """
+        :param parent: this token is canceled with the parent.
+        """
+        self._callbacks: List[CancelCallback] = None
+        self._lock = threading.Lock()
+        self._canceled = False
+        self.reason = None
+        if parent is not None:
+            parent.on_cancel(self.cancel)
+
+    def cancel(self, reason: Any = None):
+        """
+        Cancel the token, call the callbacks with the reason.
+
+        Errors do not stop the other callbacks, the first one is raised after.
+
+        :param reason: why it's canceled, given to the promises errors.
+        :return:
+        """
+        with self._lock:
+            if self._canceled:
+                return
+            self._canceled = True
+            self.reason = reason
+            callbacks = self._callbacks
+            self._callbacks = None
+        error = None
+        for callback in callbacks or ():
+            try:
+                callback(reason)
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+    def on_cancel(self, func: CancelCallback):
+        """
+        Add a callback to call with the reason on cancel, called right
+        away if the token is already canceled.
+
+        :param func:
+        :return:
+        """
+        with self._lock:
+            if not self._canceled:
+                if self._callbacks is None:
+                    self._callbacks = []
+                self._callbacks.append(func)
+                return
+        func(self.reason)
+
+    def raise_if_canceled(self):
+        """For starters, stop by raising a PromiseCanceledError."""
+        if self._canceled:
+            raise PromiseCanceledError(self.reason)
+
+    @property
+    def canceled(self) -> bool:
+        return self._canceled
@@ -1,10 +1,10 @@
-import collections
+import collections.abc
 import uuid
 import functools
 
-from typing import Dict, Callable, List
+from typing import Dict, Callable, Optional, Union, NamedTuple, Tuple
 
-from prompy.promise import Promise
+from prompy.promise import Promise, PromiseState
 
 
 class BasePromiseContainer:
@@ -29,6 +29,17 @@ class BasePromiseContainer:
             self.add_promise(promise)
 
 
+class ShutdownReport(NamedTuple):
+    """What a runner shutdown left undone."""
+    # every promise added was started and the workers stopped in time.
+    drained: bool
+    # promises not started, they were canceled.
+    canceled: Tuple[Promise, ...]
+    # workers still busy at the deadline, threads are left to finish
+    # their promise, processes are terminated.
+    unjoined: int
+
+
 class BasePromiseRunner(BasePromiseContainer):
     """A container that need to start and stop."""
     def add_promise(self, promise: Promise):
@@ -41,20 +52,46 @@ class BasePromiseRunner(BasePromiseContainer):
         raise NotImplementedError
 
 
-class PromiseContainer(BasePromiseContainer, collections.Container):
+class PromiseContainer(BasePromiseContainer, collections.abc.Container):
     """
     Basic promise container.
 
-    Keeps the promises in a dict with the promise id as key.
+    Keeps the promises in a dict with the promise serial as key,
+    runners release them once settled.
     """
     def __init__(self):
-        self._promises: Dict[uuid.UUID, Promise] = {}
+        self._promises: Dict[int, Promise] = {}
 
     def __contains__(self, x: Promise):
-        return x.id in self._promises
+        return x.serial in self._promises
 
     def add_promise(self, promise: Promise):
-        self._promises[promise.id] = promise
+        self._promises[promise.serial] = promise
+
+    def _release(self, promise: Promise):
+        """Forget a started promise once it's settled, its results go with it."""
+        if promise.state == PromiseState.pending:
+            promise.complete(functools.partial(self._forget, promise.serial))
+            if promise.state == PromiseState.pending:
+                return
+            # Settled before the complete callback was added.
+        self._forget(promise.serial)
+
+    def _forget(self, serial: int, *_):
+        self._promises.pop(serial, None)
+
+    def get_promise(self, promise_id: Union[int, uuid.UUID]) -> Optional[Promise]:
+        """
+        Find a promise in the container.
+
+        :param promise_id: the serial or the uuid of the promise.
+        :return: the promise or None
+        """
+        if isinstance(promise_id, uuid.UUID):
+            # uuid are generated on demand, only promises with one can match.
+            return next((p for p in self._promises.values()
+                         if p._promise_id == promise_id), None)
+        return self._promises.get(promise_id)
 
 
 def container_wrap(func: Callable[..., Promise]) -> Callable[..., Promise]:
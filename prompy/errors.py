@@ -10,5 +10,29 @@ class PromiseRejectionError(PromiseError):
     """Raised when a promise is called with raise_again option"""
 
 
+class PromiseTimeoutError(PromiseError):
+    """Raised when a promise is not settled in time."""
+
+
+class PromiseCanceledError(PromiseError):
+    """Rejection of a canceled promise."""
+
+    def __init__(self, reason=None):
+        super().__init__(reason if reason is not None else 'Promise canceled')
+        self.reason = reason
+
+
+class PromiseOverloadError(PromiseError):
+    """A promise was refused or dropped by a full queue."""
+
+
 class UrlCallError(PromiseError):
     """Web call error"""
+
+
+class PromiseAggregateError(PromiseError):
+    """Raised when all the promises of a combinator were rejected."""
+
+    def __init__(self, message, errors):
+        super().__init__(message)
+        self.errors = errors
@@ -1,4 +1,6 @@
+import collections
 import marshal
+import threading
 import types
 
 from typing import NamedTuple
@@ -23,8 +25,11 @@ def serialize_closure(closure):
 def deserialize_closure(closure):
     if not closure:
         return
-    c = marshal.loads(closure)
-    fun = (lambda *args: lambda: args)(*c)
+    return _make_cells(marshal.loads(closure))
+
+
+def _make_cells(values: tuple):
+    fun = (lambda *args: lambda: args)(*values)
     return fun.__closure__
 
 
@@ -35,12 +40,37 @@ def serialize_fun(fun):
     return SerializedFunction(code, argsdef, closure, fun.__name__)
 
 
+# Unmarshalled code, defaults and closure values by serialized function.
+_functions: 'collections.OrderedDict[SerializedFunction, tuple]' = collections.OrderedDict()
+_functions_lock = threading.Lock()
+FUNCTIONS_CACHE_SIZE = 256
+
+
 def deserialize_fun(fun: SerializedFunction, namespace=None):
+    """
+    Rebuild a serialized function.
+
+    The unmarshalled parts are cached by serialized function, each call
+    returns a new function with its own globals and closure cells.
+
+    :param fun:
+    :param namespace: globals of the function.
+    :return:
+    """
+    with _functions_lock:
+        parts = _functions.get(fun)
+        if parts is not None:
+            _functions.move_to_end(fun)
+    if parts is None:
+        parts = (marshal.loads(fun.code), marshal.loads(fun.argsdef),
+                 marshal.loads(fun.closure) if fun.closure else None)
+        with _functions_lock:
+            _functions[fun] = parts
+            if len(_functions) > FUNCTIONS_CACHE_SIZE:
+                _functions.popitem(last=False)
+    code, argsdef, closure = parts
     ns = namespace or {}
     namespace = dict(**ns, **globals())  # add global otherwise no access to builtins.
-    code = marshal.loads(fun.code)
-    argsdef = marshal.loads(fun.argsdef)
-    closure = deserialize_closure(fun.closure)
     # noinspection PyArgumentList
-    return types.FunctionType(code, namespace, fun.name, argsdef, closure)
-
+    return types.FunctionType(code, namespace, fun.name, argsdef,
+                              _make_cells(closure) if closure else None)
@@ -0,0 +1,250 @@
+"""
+Interop with :py:mod:`concurrent.futures` and :py:mod:`asyncio` futures.
+
+:Example:
+
+.. code-block:: python
+
+    from prompy.futures import PromiseExecutor
+
+    # Runs on the TPromise thread pool, no second pool next to it.
+    with PromiseExecutor() as executor:
+        sizes = list(executor.map(len, pages, chunksize=16))
+
+The conversions add callbacks to the promise or the future, nothing is
+polled and no thread waits for the outcome. Canceling one side cancels
+the other.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import threading
+from typing import Callable, Any, Iterable, Iterator, Set, Type, Union
+
+from prompy.container import BasePromiseContainer
+from prompy.function_serializer import serialize_fun
+from prompy.promise import Promise
+
+AnyFuture = Union[concurrent.futures.Future, asyncio.Future]
+
+
+def _set_result(future: AnyFuture, result: Any):
+    try:
+        future.set_result(result)
+    except (concurrent.futures.InvalidStateError, asyncio.InvalidStateError):
+        pass  # canceled, or a promise resolved more than once.
+
+
+def _set_exception(future: AnyFuture, error: Exception):
+    try:
+        future.set_exception(error)
+    except (concurrent.futures.InvalidStateError, asyncio.InvalidStateError):
+        pass
+
+
+def _call_soon(loop: asyncio.AbstractEventLoop, func: Callable, future: asyncio.Future, value: Any):
+    loop.call_soon_threadsafe(func, future, value)
+
+
+def _cancel_promise(promise: Promise, future: AnyFuture):
+    if future.cancelled():
+        promise.cancel('future canceled')
+
+
+def _link(promise: Promise, future: concurrent.futures.Future):
+    # noinspection PyProtectedMember
+    promise._add_reaction(functools.partial(_set_result, future),
+                          functools.partial(_set_exception, future))
+    future.add_done_callback(functools.partial(_cancel_promise, promise))
+
+
+def to_future(promise: Promise) -> concurrent.futures.Future:
+    """
+    A future settled with the first outcome of the promise.
+
+    The future handles the rejections of the promise, canceling the
+    future cancels the promise.
+
+    :param promise:
+    :return:
+    """
+    future = concurrent.futures.Future()
+    _link(promise, future)
+    return future
+
+
+def to_asyncio_future(promise: Promise, loop: asyncio.AbstractEventLoop = None) -> asyncio.Future:
+    """
+    An asyncio future of the loop settled with the first outcome of the
+    promise, from any thread.
+
+    :param promise:
+    :param loop: the loop of the future, the current one by default.
+    :return:
+    """
+    from prompy.awaitable import AwaitablePromise
+    loop = loop or asyncio.get_event_loop()
+    if isinstance(promise, AwaitablePromise) and promise.loop is loop:
+        return promise.future
+    future = loop.create_future()
+    # noinspection PyProtectedMember
+    promise._add_reaction(functools.partial(_call_soon, loop, _set_result, future),
+                          functools.partial(_call_soon, loop, _set_exception, future))
+    future.add_done_callback(functools.partial(_cancel_promise, promise))
+    return future
+
+
+def _settle_from_future(promise: Promise, future: AnyFuture):
+    if future.cancelled():
+        promise.cancel('future canceled')
+    elif future.exception() is not None:
+        promise.reject(future.exception())
+    else:
+        promise.resolve(future.result())
+
+
+def _cancel_future(future: AnyFuture, _reason=None):
+    if asyncio.isfuture(future):
+        future.get_loop().call_soon_threadsafe(future.cancel)
+    else:
+        future.cancel()
+
+
+def from_future(future: AnyFuture, prom_type: Type[Promise] = Promise, **kwargs) -> Promise:
+    """
+    A promise settled by a concurrent or asyncio future.
+
+    Canceling the promise cancels the future.
+
+    :param future:
+    :param prom_type: the type of the deferred promise.
+    :param kwargs: given to the `prom_type.deferred`.
+    :return:
+    """
+    promise = prom_type.deferred(**kwargs)
+    promise.token.on_cancel(functools.partial(_cancel_future, future))
+    future.add_done_callback(functools.partial(_settle_from_future, promise))
+    return promise
+
+
+def _call_starter(future: concurrent.futures.Future, fn: Callable, args, kwargs, resolve, _):
+    if future.set_running_or_notify_cancel():
+        resolve(fn(*args, **kwargs))
+
+
+def _process_call_starter(resolve, _):
+    # Run in a worker, the _call names are in the namespace.
+    from prompy.function_serializer import deserialize_fun
+    fn = deserialize_fun(_call_fn)  # noqa: F821
+    if _call_chunk:  # noqa: F821
+        resolve([fn(*args) for args in _call_args])  # noqa: F821
+    else:
+        resolve(fn(*_call_args, **_call_kwargs))  # noqa: F821
+
+
+class _ChunkCall:
+    """Call fn with each args of a chunk, a process worker does it from fn."""
+    __slots__ = ('fn',)
+
+    def __init__(self, fn: Callable):
+        self.fn = fn
+
+    def __call__(self, chunk: Iterable[tuple]) -> list:
+        return [self.fn(*args) for args in chunk]
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[tuple]:
+    iterator = iter(iterable)
+    while True:
+        chunk = tuple(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class PromiseExecutor(concurrent.futures.Executor):
+    """
+    A :py:class:`concurrent.futures.Executor` running the calls as
+    promises of a container, the TPromise thread pool by default.
+
+    With a :py:class:`~prompy.processio.process_containers.PromiseProcessPool`
+    the calls are ProcessPromise, the functions are serialized like their
+    starters and the arguments must be picklable. Their errors are
+    handled by the futures, they don't stop the workers.
+    """
+
+    def __init__(self, container: BasePromiseContainer = None,
+                 prom_type: Type[Promise] = Promise, **prom_kwargs):
+        """
+        :param container: where the promises are added, the global pool
+            of :py:mod:`prompy.threadio.tpromise` by default.
+        :param prom_type: type of the promises, it must not insert itself.
+        :param prom_kwargs: given to the promises.
+        """
+        if container is None:
+            from prompy.threadio.tpromise import get_pool
+            container = get_pool()
+        from prompy.processio.process_containers import PromiseProcessPool
+        from prompy.processio.process_promise import ProcessPromise
+        if isinstance(container, PromiseProcessPool) and not issubclass(prom_type, ProcessPromise):
+            prom_type = ProcessPromise
+        self._processes = issubclass(prom_type, ProcessPromise)
+        self._container = container
+        self._prom_type = prom_type
+        self._prom_kwargs = prom_kwargs
+        self._pending: Set[concurrent.futures.Future] = set()
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        if self._processes:
+            chunk = isinstance(fn, _ChunkCall)
+            namespace = {'_call_fn': serialize_fun(fn.fn if chunk else fn), '_call_chunk': chunk,
+                         '_call_args': args[0] if chunk else args, '_call_kwargs': kwargs}
+            promise = self._prom_type(_process_call_starter, namespace=namespace, **self._prom_kwargs)
+            # The outcome comes back from the worker to the proxy,
+            # linked first, the worker sees the rejections as handled.
+            _link(promise.proxy, future)
+        else:
+            promise = self._prom_type(
+                functools.partial(_call_starter, future, fn, args, kwargs), **self._prom_kwargs)
+            _link(promise, future)
+        self._container.add_promise(promise)
+        return future
+
+    def map(self, fn: Callable, *iterables, timeout: float = None, chunksize: int = 1) -> Iterator:
+        """
+        Like the builtin map, the calls are made in chunks of `chunksize`.
+        """
+        if chunksize <= 1:
+            return super().map(fn, *iterables, timeout=timeout)
+        results = super().map(_ChunkCall(fn), _chunks(zip(*iterables), chunksize), timeout=timeout)
+        return itertools.chain.from_iterable(results)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        """
+        Refuse new calls, the container is not stopped, it may be shared.
+
+        :param wait: wait for the calls submitted to this executor.
+        :param cancel_futures: cancel the calls that did not start.
+        :return:
+        """
+        with self._lock:
+            self._shutdown = True
+            pending = list(self._pending)
+        if cancel_futures:
+            for future in pending:
+                future.cancel()
+        if wait:
+            concurrent.futures.wait(pending)
+
+    def _done(self, future: concurrent.futures.Future):
+        with self._lock:
+            self._pending.discard(future)
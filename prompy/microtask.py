@@ -0,0 +1,185 @@
+"""
+Microtask queues for promise callbacks.
+
+Promise callbacks are not called in the stack of the resolver, they are
+queued and run by a trampoline loop. Callbacks queued while a queue is
+draining (or held by a running starter) are run by the outer loop, so
+chains of any length run in constant stack depth and callbacks are run
+in batch after the starter instead of interleaved with it.
+
+* :py:class:`MicrotaskQueue` - one per thread, drained synchronously.
+* :py:class:`LoopMicrotaskQueue` - one per asyncio loop, drained by a
+  single loop callback.
+"""
+import asyncio
+import collections
+import os
+import threading
+import weakref
+
+from typing import Callable, Deque, Tuple
+
+
+class MicrotaskQueue:
+    """Trampolined queue of callbacks for the current thread."""
+    __slots__ = ('_tasks', '_depth')
+
+    def __init__(self):
+        self._tasks: Deque[Tuple[Callable, tuple]] = collections.deque()
+        self._depth = 0
+
+    def enqueue(self, func: Callable, *args):
+        """
+        Queue a callback, run it right away if the queue is not busy.
+
+        :param func: callback to run
+        :param args: arguments of the callback
+        :return:
+        """
+        self._tasks.append((func, args))
+        if not self._depth:
+            self.drain()
+
+    def hold(self):
+        """Defer the draining of the queue until :py:meth:`release`."""
+        self._depth += 1
+
+    def release(self):
+        """Release a hold, drain the queue if it was the last one."""
+        self._depth -= 1
+        if not self._depth and self._tasks:
+            self.drain()
+
+    def drain(self):
+        """
+        Run all the queued callbacks, including those queued while draining.
+
+        Errors do not stop the draining, the first one is raised after
+        the queue is empty.
+        """
+        error = None
+        tasks = self._tasks
+        self._depth += 1
+        try:
+            while tasks:
+                func, args = tasks.popleft()
+                try:
+                    func(*args)
+                except Exception as e:
+                    if error is None:
+                        error = e
+        finally:
+            self._depth -= 1
+        if error is not None:
+            raise error
+
+    @property
+    def busy(self) -> bool:
+        return self._depth > 0
+
+    def __len__(self):
+        return len(self._tasks)
+
+
+class LoopMicrotaskQueue:
+    """
+    Queue of callbacks for an asyncio loop.
+
+    All the callbacks queued in between two loop iterations are run by
+    the same loop callback, errors are sent to the loop exception handler.
+    """
+    __slots__ = ('_loop', '_tasks', '_scheduled')
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        # weak, the queue is kept in a dict keyed by the loop.
+        self._loop = weakref.ref(loop)
+        self._tasks: Deque[Tuple[Callable, tuple]] = collections.deque()
+        self._scheduled = False
+
+    def enqueue(self, func: Callable, *args):
+        """
+        Queue a callback to run on the loop, thread safe.
+
+        :param func: callback to run
+        :param args: arguments of the callback
+        :return:
+        """
+        self._tasks.append((func, args))
+        if not self._scheduled:
+            self._scheduled = True
+            self._loop().call_soon_threadsafe(self.drain)
+
+    def drain(self):
+        tasks = self._tasks
+        while True:
+            while tasks:
+                func, args = tasks.popleft()
+                try:
+                    func(*args)
+                except Exception as e:
+                    self._loop().call_exception_handler({
+                        'message': f'Exception in promise callback {func!r}',
+                        'exception': e,
+                    })
+            self._scheduled = False
+            # A task added from another thread after the last check
+            # would otherwise wait for the next enqueue.
+            if not tasks:
+                return
+            self._scheduled = True
+
+    def __len__(self):
+        return len(self._tasks)
+
+
+_local = threading.local()
+_loop_queues = weakref.WeakKeyDictionary()
+_loop_queues_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # A thread of the parent may hold it, the child would wait forever.
+    global _loop_queues_lock
+    _loop_queues_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_queue() -> MicrotaskQueue:
+    """The microtask queue of the current thread."""
+    try:
+        return _local.queue
+    except AttributeError:
+        queue = _local.queue = MicrotaskQueue()
+        return queue
+
+
+def run_isolated(func: Callable, *args):
+    """
+    Run func with a new queue for the current thread, the callbacks
+    queued by func are run before returning even if the thread queue
+    is busy.
+    """
+    previous = get_queue()
+    queue = _local.queue = MicrotaskQueue()
+    queue.hold()
+    try:
+        return func(*args)
+    finally:
+        try:
+            queue.release()
+        finally:
+            _local.queue = previous
+
+
+def get_loop_queue(loop: asyncio.AbstractEventLoop) -> LoopMicrotaskQueue:
+    """The microtask queue of an asyncio loop."""
+    queue = _loop_queues.get(loop)
+    if queue is None:
+        with _loop_queues_lock:
+            queue = _loop_queues.get(loop)
+            if queue is None:
+                queue = _loop_queues[loop] = LoopMicrotaskQueue(loop)
+    return queue
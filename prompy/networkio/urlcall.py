@@ -1,4 +1,5 @@
 import json
+import socket
 from typing import Any, Callable
 from urllib import request, error
 
@@ -27,14 +28,17 @@ def url_call(url,
     :param method:
     :param content_mapper:
     :param prom_type:
-    :param kwargs:
+    :param kwargs: kwargs of the promise, the `timeout` is also used for the socket.
     :return: A promise to resolve with a response.
     """
+    # don't keep the worker after the promise timed out.
+    socket_timeout = kwargs.get('timeout') or socket.getdefaulttimeout()
+
     def starter(resolve, reject):
         try:
             req = request.Request(url, data=data, headers=headers or {},
                                   origin_req_host=origin_req_host, method=method, unverifiable=unverifiable)
-            with request.urlopen(req) as rep:
+            with request.urlopen(req, timeout=socket_timeout) as rep:
                 content_type = rep.headers.get_content_type()
                 encoding = rep.headers.get_content_charset()
                 rep_headers = {}
@@ -69,7 +69,8 @@ def command(cmd: str,
     Start a process with subprocess.Popen, resolve when it stops.
 
     :param cmd: The command to execute as a string.
-    :param timeout: The max amount of time the process will stay open.
+    :param timeout: The max amount of time the process will stay open,
+        the process is also killed when the promise is canceled.
     :param communicate_timeout: Timeout to `proc.communicate`
     :param sleep_time: arg to yield from asyncio.sleep
     :param output_mapper: method to receive the output of the process.
@@ -86,7 +87,7 @@ def command(cmd: str,
     def starter(resolve, reject):
         pkw = proc_kwargs or {}
         line = shlex.split(cmd, posix=posix)
-        future: asyncio.Future = getattr(promise, 'future', None)
+        is_async = isinstance(promise, AwaitablePromise)
         started = time.time()
         status = None
         results = []
@@ -95,6 +96,9 @@ def command(cmd: str,
             with subprocess.Popen(line, stdout=subprocess.PIPE,
                                   stderr=subprocess.PIPE, **pkw) as proc:
                 while status is None:
+                    if promise.canceled:
+                        proc.kill()
+                        return
 
                     try:
                         out, err = output_mapper(*proc.communicate(timeout=communicate_timeout),
@@ -108,7 +112,7 @@ def command(cmd: str,
                         if 0 < timeout < time.time() - started:
                             proc.kill()
                             reject(err)
-                    if future:
+                    if is_async:
                         yield from asyncio.sleep(sleep_time)
         except Exception as e:
             reject(e)
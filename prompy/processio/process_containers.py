@@ -1,12 +1,26 @@
 """Experimental multiprocessing promise containers."""
+import collections
+import functools
+import itertools
 import multiprocessing
+import pickle
+import threading
 import time
-from queue import Empty
-from typing import Callable, NamedTuple, List
+import uuid
+from queue import Empty, SimpleQueue
+from typing import Callable, NamedTuple, List, Set, Optional, Dict, Iterable, Tuple, Deque
 
-from prompy.container import BasePromiseContainer, BasePromiseRunner
+from prompy.backpressure import QueueLimits, Capacity
+from prompy.container import BasePromiseContainer, BasePromiseRunner, ShutdownReport
+from prompy.errors import PromiseError, PromiseTimeoutError, PromiseOverloadError, \
+    PromiseCanceledError
+from prompy.processio import shared_payload
 from prompy.processio.process_promise import ProcessPromise
-from prompy.promise import Promise
+from prompy.promise import Promise, PromiseState
+from prompy.timers import get_timer_service
+
+# Stops the worker once the promises before it ran.
+_DRAIN = None
 
 
 class ProcessPromiseQueue(BasePromiseContainer):
@@ -14,6 +28,19 @@ class ProcessPromiseQueue(BasePromiseContainer):
     A queue for a process promise.
 
     Usage: `multiprocess.Process(target=ProcessPromiseQueue.run)`
+
+    The queue is unbounded unless given `limits`, see :py:mod:`prompy.backpressure`.
+    Promises dropped or shed by the limits are reported in the errors.
+
+    Large buffers of the promises and of their results go through shared
+    memory, see :py:mod:`prompy.processio.shared_payload`.
+
+    :py:meth:`add_promises` queues the promises in batches, the worker
+    takes a batch at once and sends the outcomes back together, at the
+    end of the batch or after `poll_time`.
+
+    A promise canceled before the worker takes its batch frees its slot
+    right away, the worker frees one slot less for the next batch it takes.
     """
     __queue_index = 0
 
@@ -23,7 +50,10 @@ class ProcessPromiseQueue(BasePromiseContainer):
                  poll_time: float=0.01,
                  error_list: multiprocessing.Queue=None,
                  idle_check: bool=False,
-                 raise_again: bool=True):
+                 raise_again: bool=True,
+                 limits: QueueLimits=None,
+                 results: multiprocessing.Queue=None,
+                 shared_threshold: int=shared_payload.SHARED_THRESHOLD):
         """
         Queue initializer.
 
@@ -33,21 +63,195 @@ class ProcessPromiseQueue(BasePromiseContainer):
         :param error_list: a multiprocess container to exchange errors.
         :param idle_check: to use the idle timeout or not.
         :param raise_again: to raise errors again after catch (stop the queue).
+        :param limits: capacity and overflow policy of the queue.
+        :param results: a multiprocess queue to send the outcomes back to the parent.
+        :param shared_threshold: size from which the buffers go through shared memory.
         """
         self._index = self.__queue_index
         self.__queue_index += 1
         self.max_idle = max_idle
         self.poll_time = poll_time
         self._queue: multiprocessing.Queue = multiprocessing.Queue()
+        self._cancel_queue: multiprocessing.Queue = multiprocessing.Queue()
+        self._capacity = Capacity(limits, multiprocessing.Semaphore)
+        self._producer_lock = threading.Lock()
+        # the slots of a batch are freed by who takes it out of the queue,
+        # cancels free them before, these are counted in `_freed` to not free them twice.
+        self._batch_seq = itertools.count(1)
+        self._slots_lock = multiprocessing.Lock()
+        self._taken = multiprocessing.Value('q', 0, lock=False)
+        self._freed = multiprocessing.Value('q', 0, lock=False)
+        # parent side, batch of the queued promises, to free their slot on cancel.
+        self._queued: Dict[uuid.UUID, int] = {}
+        self._queued_batches: Deque[Tuple[int, Tuple[uuid.UUID, ...]]] = collections.deque()
+        self._removed_batches: Set[int] = set()
+        self._queued_lock = threading.Lock()
+        self._canceled: Set[uuid.UUID] = set()
         self._on_idle: Callable = on_idle
         self._running = False
         self._errors = []
         self._raise_again = raise_again
         self._idle_check = idle_check
         self._error_list = error_list
+        self._results = results
+        self._shared_threshold = shared_threshold
+        # start time and id of the running promise, 0 when waiting.
+        self._busy_since = multiprocessing.Value('d', 0.0, lock=False)
+        self._running_id = multiprocessing.Array('c', 16, lock=False)
+        # outcomes not sent yet and when the first was added.
+        self._outcomes: List[tuple] = []
+        self._outcomes_since = 0.0
 
     def add_promise(self, promise: ProcessPromise):
-        self._queue.put(promise)
+        """
+        :param promise:
+        :raises PromiseOverloadError: the queue is full, the promise is rejected.
+        """
+        self._put((promise,))
+
+    def add_promises(self, *promises: ProcessPromise):
+        """
+        Queue the promises in one batch, in batches of the capacity if bounded.
+
+        :param promises:
+        :raises PromiseOverloadError: the queue is full, the promises
+            not queued are rejected.
+        """
+        size = self._capacity.limits.capacity or len(promises)
+        for start in range(0, len(promises), size):
+            try:
+                self._put(promises[start:start + size])
+            except Exception as e:
+                for promise in promises[start + size:]:
+                    promise._abandon(e)
+                raise
+
+    def _put(self, promises):
+        acquired = 0
+        bounded = self._capacity.limits.capacity > 0
+        try:
+            if bounded:
+                # all the slots of a batch or none, producers waiting
+                # with part of the slots would wait on each other.
+                with self._producer_lock:
+                    for _ in promises:
+                        self._capacity.acquire(self._evict)
+                        acquired += 1
+            seq = next(self._batch_seq) if bounded else 0
+            enqueued = time.monotonic()
+            payload = shared_payload.dumps((seq, [(promise, enqueued) for promise in promises]),
+                                           self._shared_threshold)
+        except Exception as e:
+            for _ in range(acquired):
+                self._capacity.release()
+            for promise in promises:
+                promise._abandon(e)
+            raise
+        if bounded:
+            self._track(seq, promises)
+        self._queue.put(payload)
+
+    def _track(self, seq: int, promises):
+        ids = tuple(promise.id for promise in promises)
+        with self._queued_lock:
+            batches = self._queued_batches
+            taken = self._taken.value
+            # forget the batches the worker took.
+            while batches and (batches[0][0] <= taken or batches[0][0] in self._removed_batches):
+                old_seq, old_ids = batches.popleft()
+                self._removed_batches.discard(old_seq)
+                for promise_id in old_ids:
+                    self._queued.pop(promise_id, None)
+            batches.append((seq, ids))
+            for promise_id in ids:
+                self._queued[promise_id] = seq
+
+    def _take(self, item, removed: bool = False) -> Tuple[list, int]:
+        """
+        Load a batch taken out of the queue and free its slots, but those
+        already freed by cancels.
+
+        :param removed: taken by the parent, the worker will not see it.
+        :return: the batch and the number of slots freed.
+        """
+        seq, batch = shared_payload.loads(item)
+        if not seq:
+            return batch, 0
+        if removed:
+            with self._queued_lock:
+                self._removed_batches.add(seq)
+                for promise, _ in batch:
+                    self._queued.pop(promise.id, None)
+        with self._slots_lock:
+            if not removed and seq > self._taken.value:
+                self._taken.value = seq
+            freed = min(self._freed.value, len(batch))
+            self._freed.value -= freed
+        return batch, len(batch) - freed
+
+    def _evict(self) -> bool:
+        while True:
+            try:
+                batch, slots = self._take(self._queue.get_nowait(), removed=True)
+            except Empty:
+                return False
+            for promise, _ in batch:
+                self._overload(promise, 'dropped from a full queue')
+            self._flush()
+            if slots:
+                # the slot of one is given to the new promise.
+                for _ in range(slots - 1):
+                    self._capacity.release()
+                return True
+
+    def finish(self):
+        """Stop the worker once the queued promises ran."""
+        self._queue.put(_DRAIN)
+
+    def take_queued(self) -> List[Promise]:
+        """
+        Take out the promises the worker did not start, from the parent.
+
+        :return: copies of the promises, marked canceled.
+        """
+        promises = []
+        while True:
+            try:
+                item = self._queue.get(timeout=max(self.poll_time, 0.05))
+            except Empty:
+                return promises
+            if item is _DRAIN:
+                continue
+            batch, slots = self._take(item, removed=True)
+            for _ in range(slots):
+                self._capacity.release()
+            for promise, _ in batch:
+                promise.canceled = True
+                promises.append(promise)
+
+    def cancel(self, promise_id: uuid.UUID, _reason=None):
+        """Skip the promise if the worker did not start it yet, free its slot now."""
+        self._cancel_queue.put(promise_id)
+        with self._queued_lock:
+            seq = self._queued.pop(promise_id, None)
+        if seq is None:
+            return
+        with self._slots_lock:
+            if seq <= self._taken.value:
+                return  # the worker took it and freed the slot.
+            self._freed.value += 1
+        self._capacity.release()
+
+    def _is_canceled(self, promise: Promise) -> bool:
+        while True:
+            try:
+                self._canceled.add(self._cancel_queue.get_nowait())
+            except Empty:
+                break
+        if promise.id in self._canceled:
+            self._canceled.discard(promise.id)
+            return True
+        return promise.canceled
 
     def run(self):
         idle_start = None
@@ -55,8 +259,13 @@ class ProcessPromiseQueue(BasePromiseContainer):
 
         while True:
             try:
-                current: Promise = self._queue.get(timeout=self.poll_time)
-                current.exec()
+                item = self._queue.get(timeout=self.poll_time)
+                if item is _DRAIN:
+                    self._running = False
+                    return
+                batch, slots = self._take(item)
+                for _ in range(slots):
+                    self._capacity.release()
                 idle_start = None
             except Empty:
                 if not self._idle_check:
@@ -74,13 +283,92 @@ class ProcessPromiseQueue(BasePromiseContainer):
                         else:
                             self._running = False
                             return
+                continue
             except Exception as e:
-                self._errors.append(e)
-                if self._error_list:
-                    self._error_list.put(e)
-                if self._raise_again:
-                    self._running = False
-                    raise
+                self._report(e)
+                continue
+            try:
+                for current, enqueued in batch:
+                    try:
+                        self._start(current, enqueued)
+                    except Exception as e:
+                        self._report(e)
+            finally:
+                self._flush()
+
+    def _report(self, error: Exception):
+        self._errors.append(error)
+        if self._error_list:
+            self._error_list.put(error)
+        if self._raise_again:
+            self._running = False
+            raise error
+
+    def _start(self, current: Promise, enqueued: float):
+        if self._is_canceled(current):
+            return
+        if current.expired:
+            self._expired(current)
+            return
+        if self._capacity.expired(enqueued):
+            self._overload(current, 'waited too long in the queue')
+            return
+        self._running_id.raw = current.id.bytes
+        self._busy_since.value = time.monotonic()
+        try:
+            current.exec()
+        finally:
+            self._busy_since.value = 0.0
+            self._running_id.raw = bytes(16)
+            self._send(current, *current._outcome())
+            if time.monotonic() - self._outcomes_since >= self.poll_time:
+                self._flush()
+
+    def _expired(self, promise: Promise):
+        promise.canceled = True
+        error = PromiseTimeoutError(f"Promise {promise.id} expired before it started")
+        self._errors.append(error)
+        if self._error_list:
+            self._error_list.put(error)
+        self._send(promise, (), error)
+
+    def _overload(self, promise: Promise, why: str):
+        promise.canceled = True
+        error = PromiseOverloadError(f"Promise {promise.id} {why}")
+        self._errors.append(error)
+        if self._error_list:
+            self._error_list.put(error)
+        self._send(promise, (), error)
+
+    def _send(self, promise: Promise, results: tuple, error: Optional[Exception]):
+        if self._results is None:
+            return
+        if not self._outcomes:
+            self._outcomes_since = time.monotonic()
+        self._outcomes.append((promise.id, results, error))
+
+    def _flush(self):
+        """Send the outcomes in one message."""
+        outcomes = self._outcomes
+        if not outcomes:
+            return
+        self._outcomes = []
+        try:
+            # pickled here, the queue feeder thread would only print the errors.
+            data = shared_payload.dumps(outcomes, self._shared_threshold)
+        except Exception:
+            data = shared_payload.dumps([self._checked(*outcome) for outcome in outcomes],
+                                        self._shared_threshold)
+        self._results.put(data)
+
+    @staticmethod
+    def _checked(promise_id: uuid.UUID, results: tuple, error: Optional[Exception]) -> tuple:
+        try:
+            pickle.dumps((results, error))
+        except Exception as e:
+            return promise_id, (), PromiseError(
+                f"Outcome of promise {promise_id} could not be sent: {e!r}")
+        return promise_id, results, error
 
     @property
     def id(self) -> int:
@@ -88,13 +376,25 @@ class ProcessPromiseQueue(BasePromiseContainer):
 
     @property
     def num_tasks(self) -> int:
-        """The number of promise still to resolve."""
+        """The number of batches still in the queue."""
         return self._queue.qsize()
 
     @property
     def running(self):
         return self._running
 
+    @property
+    def busy_for(self) -> float:
+        """Seconds the worker has been running its current promise, 0 if waiting."""
+        since = self._busy_since.value
+        return time.monotonic() - since if since else 0.0
+
+    @property
+    def running_id(self) -> Optional[uuid.UUID]:
+        """Id of the promise the worker is running."""
+        raw = self._running_id.raw
+        return uuid.UUID(bytes=raw) if any(raw) else None
+
     @property
     def errors(self):
         return tuple(self._errors)
@@ -106,48 +406,383 @@ class _ProcessingQueue(NamedTuple):
     queue: ProcessPromiseQueue
 
 
+class _InFlight(NamedTuple):
+    # the parent copy, sent again if the worker dies.
+    promise: ProcessPromise
+    # times it was running when its worker died.
+    retries: int
+
+
 class PromiseProcessPool(BasePromiseRunner):
-    """A pool of PromiseQueue to add promise to."""
-    def __init__(self, pool_size=10, queue_options=None):
+    """
+    A pool of PromiseQueue to add promise to.
+
+    The outcomes of the promises are sent back and settle their
+    :py:attr:`~prompy.processio.process_promise.ProcessPromise.proxy`
+    from a collector thread.
+
+    Promises go to the worker with the fewest promises without outcome.
+    The collector thread checks the workers every `health_interval`,
+    the dead ones, and the stuck ones after `stuck_timeout`, are
+    replaced and their promises without outcome sent to the others.
+
+    Small promises are cheaper sent in batches, with
+    :py:meth:`add_promises` or with a `batch_size`: the promises added
+    within `batch_window` are sent together. A batch taken by a worker
+    runs in full, even on shutdown.
+    """
+    def __init__(self, pool_size=10, queue_options=None,
+                 health_interval: float = 0.5,
+                 stuck_timeout: float = None,
+                 max_retries: int = 1,
+                 batch_size: int = 1,
+                 batch_window: float = 0.005):
         """
         :param pool_size: number of processes that will be spawned.
         :param queue_options: options to give to spawned queue
+        :param health_interval: seconds between the checks of the workers.
+        :param stuck_timeout: seconds a promise can run before its
+            worker is terminated and replaced, no limit by default.
+        :param max_retries: times a promise is sent again after its
+            worker died running it, it's rejected after.
+        :param batch_size: send the added promises by batches of this size.
+        :param batch_window: seconds to wait for more promises after the
+            first of a batch, 0 to only send when full or on :py:meth:`flush`.
         """
         self._process_index = 0
         self._next_process_id = 0
         self._processes: List[_ProcessingQueue] = []
         self._pool_size = pool_size
         self._started = False
+        self._closed = False
         self._error_list = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._collector: threading.Thread = None
         self._queue_options = queue_options or {}
+        self._health_interval = health_interval
+        self._stuck_timeout = stuck_timeout
+        self._max_retries = max_retries
+        self._lock = threading.Lock()
+        # promises sent to each worker without outcome yet.
+        self._in_flight: List[Dict[uuid.UUID, _InFlight]] = []
+        self._slots: Dict[uuid.UUID, int] = {}
+        # workers stopped on their own (idle), started again on demand.
+        self._idle: Set[int] = set()
+        self._restarts = 0
+        self._requeued = 0
+        self._batch_size = max(batch_size, 1)
+        self._batch_window = batch_window
+        self._batch: List[_InFlight] = None
+        self._batch_lock = threading.Lock()
+        # batches of expired windows, sent by the flusher thread,
+        # the timer thread must not block on a full queue.
+        self._expired_batches: SimpleQueue = None
+        self._flusher: threading.Thread = None
         while len(self._processes) < self._pool_size:
             self._add_queue()
 
     def add_promise(self, promise: ProcessPromise):
-        q = self._processes[self._process_index]
-        self._process_index += 1
-        if self._process_index >= self._pool_size:
-            self._process_index = 0
-        # TODO verify the queue is running else restart the queue
-        q.queue.add_promise(promise)
+        """
+        :param promise:
+        :raises PromiseCanceledError: the pool is shut down, the promise is canceled.
+        """
+        self._accept((promise,))
+        if self._batch_size <= 1:
+            self._dispatch([_InFlight(promise, 0)])
+        else:
+            with self._batch_lock:
+                batch = self._batch
+                if batch is None:
+                    batch = self._batch = []
+                    if self._batch_window:
+                        if self._flusher is None:
+                            self._start_flusher()
+                        get_timer_service().call_later(
+                            self._batch_window, self._expired_batches.put, batch)
+                batch.append(_InFlight(promise, 0))
+                full = len(batch) >= self._batch_size
+                if full:
+                    self._batch = None
+            if full:
+                self._dispatch(batch)
+        if not self._started:
+            self.start()
+
+    def add_promises(self, *promises: ProcessPromise, chunksize: int = None):
+        """
+        Send the promises in chunks, a chunk goes to one worker at once.
+
+        :param promises:
+        :param chunksize: promises per chunk, by default the promises
+            are split in 4 chunks per worker.
+        :raises PromiseCanceledError: the pool is shut down, the promises are canceled.
+        """
+        self._accept(promises)
+        if chunksize is None:
+            chunksize = -(-len(promises) // (4 * len(self._processes)))
+        self.flush()
+        chunksize = max(chunksize, 1)
+        for start in range(0, len(promises), chunksize):
+            self._dispatch([_InFlight(promise, 0) for promise in promises[start:start + chunksize]])
         if not self._started:
             self.start()
 
+    def _accept(self, promises):
+        if self._closed:
+            error = PromiseCanceledError('pool is shut down')
+            for promise in promises:
+                promise._abandon(error)
+            raise error
+        for promise in promises:
+            # the proxy is created now, not by the collector thread racing the caller.
+            promise.proxy  # noqa: B018
+            promise.token.on_cancel(functools.partial(self._cancel, promise.id))
+
+    def flush(self):
+        """Send the current batch without waiting for the window."""
+        with self._batch_lock:
+            batch = self._batch
+            self._batch = None
+        if batch:
+            self._dispatch(batch)
+
+    def _start_flusher(self):
+        self._expired_batches = SimpleQueue()
+        self._flusher = threading.Thread(target=self._flush_expired, args=(self._expired_batches,),
+                                         name='PromiseProcessPool-batches')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def _flush_expired(self, expired: SimpleQueue):
+        while True:
+            batch = expired.get()
+            if batch is None:
+                return
+            with self._batch_lock:
+                if self._batch is not batch:
+                    continue  # already sent when it was full.
+                self._batch = None
+            try:
+                self._dispatch(batch)
+            except Exception:
+                pass  # the promises not queued are rejected.
+
+    def _stop_flusher(self):
+        with self._batch_lock:
+            flusher, self._flusher = self._flusher, None
+        if flusher is not None:
+            self._expired_batches.put(None)
+            flusher.join()
+
+    def _dispatch(self, batch: List[_InFlight]):
+        """Send the promises to the least loaded worker."""
+        with self._lock:
+            # canceled before they were sent, the token callback found nothing.
+            batch = [sent for sent in batch if not sent.promise.canceled]
+            if not batch:
+                return
+            slot = self._least_loaded()
+            in_flight = self._in_flight[slot]
+            for sent in batch:
+                in_flight[sent.promise.id] = sent
+                self._slots[sent.promise.id] = slot
+            queue = self._processes[slot].queue
+        try:
+            queue.add_promises(*(sent.promise for sent in batch))
+        except Exception as e:
+            for sent in batch:
+                # not queued, they are canceled.
+                if not sent.promise.canceled:
+                    continue
+                self._acknowledge(sent.promise.id)
+                sent.promise.proxy._abandon(e)
+            raise
+
+    def _least_loaded(self) -> int:
+        count = len(self._processes)
+        slots = [(self._process_index + i) % count for i in range(count)]
+        self._process_index = (self._process_index + 1) % count
+        healthy = [slot for slot in slots if slot not in self._idle] or slots
+        slot = min(healthy, key=lambda x: len(self._in_flight[x]))
+        if slot in self._idle:
+            self._idle.discard(slot)
+            self._replace(slot)
+        return slot
+
+    def _acknowledge(self, promise_id: uuid.UUID) -> Optional[_InFlight]:
+        with self._lock:
+            slot = self._slots.pop(promise_id, None)
+            if slot is None:
+                return None
+            return self._in_flight[slot].pop(promise_id, None)
+
+    def _cancel(self, promise_id: uuid.UUID, _reason=None):
+        with self._lock:
+            slot = self._slots.get(promise_id)
+            queue = None if slot is None else self._processes[slot].queue
+        if self._acknowledge(promise_id) is not None:
+            queue.cancel(promise_id)
+
     def _add_queue(self):
-        queue = ProcessPromiseQueue(error_list=self._error_list, **self._queue_options)
+        self._processes.append(self._new_queue())
+        self._in_flight.append({})
+
+    def _new_queue(self) -> _ProcessingQueue:
+        queue = ProcessPromiseQueue(error_list=self._error_list, results=self._results,
+                                    **self._queue_options)
         p = multiprocessing.Process(target=queue.run, )
-        self._processes.append(_ProcessingQueue(self._next_process_id, p, queue))
         self._next_process_id += 1
+        return _ProcessingQueue(self._next_process_id - 1, p, queue)
+
+    def _replace(self, slot: int) -> Dict[uuid.UUID, _InFlight]:
+        """Start a new worker in the slot, return the promises of the previous one."""
+        self._processes[slot] = self._new_queue()
+        if self._started:
+            self._processes[slot].process.start()
+        lost = self._in_flight[slot]
+        self._in_flight[slot] = {}
+        for promise_id in lost:
+            self._slots.pop(promise_id, None)
+        return lost
 
     def start(self):
         for proc in self._processes:
             proc.process.start()
+        # after the forks, the children don't need it.
+        self._collector = threading.Thread(target=self._collect, name='PromiseProcessPool-results')
+        self._collector.daemon = True
+        self._collector.start()
         self._started = True
 
+    def _collect(self):
+        next_check = time.monotonic() + self._health_interval
+        while True:
+            try:
+                data = self._results.get(timeout=self._health_interval)
+            except Empty:
+                data = ()
+            if data is None:
+                return
+            if data:
+                for outcome in shared_payload.loads(data):
+                    self._receive(*outcome)
+            if time.monotonic() >= next_check:
+                self._check_health()
+                next_check = time.monotonic() + self._health_interval
+
+    def _receive(self, promise_id: uuid.UUID, results: tuple, error: Optional[Exception]):
+        sent = self._acknowledge(promise_id)
+        if sent is None:
+            return
+        proxy = sent.promise.proxy
+        if proxy.state != PromiseState.pending:
+            return  # timed out or canceled in this process.
+        if error is not None:
+            # Not unhandled, the worker reports its unhandled errors.
+            proxy._settle(PromiseState.rejected, error)
+        else:
+            for result in results:
+                proxy.resolve(result)
+
+    def _check_health(self):
+        for slot, proc in enumerate(list(self._processes)):
+            if self._closed:
+                return
+            if slot in self._idle:
+                continue
+            if proc.process.is_alive():
+                if not self._stuck_timeout or proc.queue.busy_for < self._stuck_timeout:
+                    continue
+                proc.process.terminate()
+            proc.process.join()
+            running = proc.queue.running_id
+            with self._lock:
+                if proc is not self._processes[slot] or self._closed:
+                    continue
+                if proc.process.exitcode == 0 and not self._in_flight[slot]:
+                    self._idle.add(slot)
+                    continue
+                lost = self._replace(slot)
+                self._restarts += 1
+            # frees the payloads left in the queue.
+            proc.queue.take_queued()
+            self._requeue(lost.values(), running, proc.process.exitcode)
+
+    def _requeue(self, lost: Iterable[_InFlight], running: Optional[uuid.UUID], exitcode: int):
+        for sent in lost:
+            # the others did not start, only the running one may be the cause.
+            retries = sent.retries + (sent.promise.id == running)
+            if retries > self._max_retries:
+                error = PromiseError(
+                    f"Promise {sent.promise.id} lost with its worker (exit code {exitcode})")
+                self._error_list.put(error)
+                sent.promise.proxy._settle(PromiseState.rejected, error)
+                continue
+            self._requeued += 1
+            try:
+                self._dispatch([_InFlight(sent.promise, retries)])
+            except PromiseError:
+                pass  # the promise and its proxy are canceled.
+
+    def _stop_collector(self, reason: str):
+        if self._collector is not None:
+            self._results.put(None)
+            self._collector.join()
+            self._collector = None
+        # the outcomes of these promises are lost.
+        with self._lock:
+            lost = [sent for in_flight in self._in_flight for sent in in_flight.values()]
+            for in_flight in self._in_flight:
+                in_flight.clear()
+            self._slots.clear()
+        for sent in lost:
+            sent.promise.proxy._cancel(reason)
+
     def stop(self):
+        self._closed = True
+        self._stop_flusher()
+        self.flush()
         for proc in self._processes:
             proc.process.terminate()
             proc.process.join()
+        for proc in self._processes:
+            # unlinks the shared memory of the payloads left in the queue.
+            proc.queue.take_queued()
+        self._stop_collector('pool stopped')
+
+    def shutdown(self, timeout: Optional[float] = None, cancel_pending: bool = False) -> ShutdownReport:
+        """
+        Stop taking promises, run or cancel the queued ones and wait
+        for the processes to stop.
+
+        :param timeout: seconds to drain the queues, the processes still
+            running after are terminated. Forever by default.
+        :param cancel_pending: cancel the queued promises right away.
+        :return: what was not done, the canceled promises are copies
+            taken from the queues.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._closed = True
+        self._stop_flusher()
+        self.flush()
+        canceled = []
+        if cancel_pending:
+            for proc in self._processes:
+                canceled.extend(proc.queue.take_queued())
+        unjoined = []
+        if self._started:
+            for proc in self._processes:
+                proc.queue.finish()
+            for proc in self._processes:
+                proc.process.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            unjoined = [proc for proc in self._processes if proc.process.is_alive()]
+            for proc in unjoined:
+                proc.process.terminate()
+                proc.process.join()
+        for proc in self._processes:
+            canceled.extend(proc.queue.take_queued())
+        self._stop_collector('pool is shut down')
+        return ShutdownReport(not canceled and not unjoined, tuple(canceled), len(unjoined))
 
     def get_errors(self):
         """Get all the errors from processes, they are consumed."""
@@ -156,5 +791,22 @@ class PromiseProcessPool(BasePromiseRunner):
 
     @property
     def num_tasks(self):
-        """Sum of all tasks still in queue."""
-        return sum([x.queue.num_tasks for x in self._processes])
+        """Promises without outcome yet."""
+        with self._batch_lock:
+            batched = len(self._batch or ())
+        return sum(self.depths) + batched
+
+    @property
+    def depths(self) -> Tuple[int, ...]:
+        """Promises sent to each worker without outcome yet."""
+        return tuple(len(x) for x in self._in_flight)
+
+    @property
+    def restarts(self) -> int:
+        """Workers replaced after they died or got stuck."""
+        return self._restarts
+
+    @property
+    def requeued(self) -> int:
+        """Promises sent again after their worker died."""
+        return self._requeued
@@ -1,10 +1,13 @@
 """Experimental multiprocess promise."""
+import itertools
 import time
+import uuid
 
-from prompy.errors import PromiseRejectionError, UnhandledPromiseError
+from prompy.errors import PromiseRejectionError, UnhandledPromiseError, PromiseTimeoutError
 from prompy.promise import Promise, PromiseStarter, PromiseState, ThenCallback, CatchCallback, TPromiseResults
 
 from prompy.function_serializer import serialize_fun, deserialize_fun
+from prompy.timers import TimerService
 
 
 class ProcessPromise(Promise):
@@ -18,13 +21,83 @@ class ProcessPromise(Promise):
     * Objects need to be marshal compatible.
     * Need to import any module at function level.
 
+    `then` and `catch` callbacks are run in the worker process.
+
+    The `proxy` is settled in the parent process with the outcome sent
+    back by a :py:class:`~prompy.processio.process_containers.PromiseProcessPool`,
+    its callbacks are regular local callbacks. A rejection handled by
+    the proxy when the promise is sent is not unhandled in the worker.
     """
+    __slots__ = ('namespace', '_then', '_catch', '_proxy', '_proxy_handled')
+
     def __init__(self, starter: PromiseStarter, namespace=None,
+                 then: ThenCallback=None, catch: CatchCallback=None,
                  *args, **kwargs):
-        super().__init__(starter, *args, **kwargs)
+        self._then = None
+        self._catch = None
+        self._proxy = None
+        self._proxy_handled = False
+        super().__init__(starter, None, None, *args, **kwargs)
+        if then:
+            self.then(then)
+        if catch:
+            self.catch(catch)
+        # The uuid must be the same on both side of the process boundary.
+        self._promise_id = uuid.uuid4()
         self.namespace = namespace
         self._starter = serialize_fun(starter)
 
+    def __getstate__(self):
+        # The cancel token and the timer stay in the parent process.
+        names = itertools.chain.from_iterable(
+            getattr(cls, '__slots__', ()) for cls in type(self).__mro__)
+        state = {name: getattr(self, name) for name in names if hasattr(self, name)}
+        state['_token'] = state['_timer'] = state['_proxy'] = None
+        # noinspection PyProtectedMember
+        state['_proxy_handled'] = self._proxy is not None and self._proxy._is_handled()
+        return None, state
+
+    @property
+    def proxy(self) -> Promise:
+        """
+        A promise of this process settled with the outcome of the
+        worker, created on demand. Canceling it cancels this promise.
+
+        It's rejected with a :py:class:`~prompy.errors.PromiseTimeoutError`
+        at the deadline of this promise, the late outcome is ignored.
+        """
+        if self._proxy is None:
+            proxy = Promise.deferred(cancel_token=self.token)
+            if self._deadline is not None:
+                # noinspection PyProtectedMember
+                timers = proxy._timers()
+                proxy._timer = timers.call_at(self._deadline, self._expire_proxy, proxy,
+                                              isinstance(timers, TimerService))
+            self._proxy = proxy
+        return self._proxy
+
+    def _expire_proxy(self, proxy: Promise, pooled: bool=False):
+        # Not unhandled, the errors are handled by the callbacks in the worker.
+        # The reactions of the timer thread run on the thread pool.
+        # noinspection PyProtectedMember
+        proxy._abandon(PromiseTimeoutError(f"Promise {self.id} timed out"), pooled)
+
+    def _outcome(self) -> tuple:
+        """The results and the error to send to the parent process."""
+        if self._error is not None:
+            return (), self._error
+        if self._results is not None:
+            return tuple(self._results), None
+        return (self._result,), None
+
+    def _set_deadline(self, timeout, deadline):
+        # No timer, it would not survive the trip to the worker process,
+        # the queue skips the promise if it's expired when it gets to it.
+        if timeout is not None:
+            expires = time.monotonic() + timeout
+            deadline = expires if deadline is None else min(deadline, expires)
+        self._deadline = deadline
+
     def exec(self):
         try:
             starter = deserialize_fun(self._starter, namespace=self.namespace)
@@ -36,21 +109,37 @@ class ProcessPromise(Promise):
                 raise PromiseRejectionError(f"Promise {self.id} was rejected") from error
         finally:
             self.completed_at = time.time()
-            for c in self._complete:
+            for c in self._complete or ():
                 c(self.result, self._error)
 
-    def then(self, func: ThenCallback):
+    def then(self, func: ThenCallback, catch: CatchCallback=None):
+        """
+        Add callbacks run in the worker process, use the `proxy` for
+        callbacks in this process.
+
+        :return: this promise.
+        """
+        if catch:
+            self.catch(catch)
+        if self._then is None:
+            self._then = []
         self._then.append(serialize_fun(func))
         return self
 
     def catch(self, func: CatchCallback):
+        """
+        Add a callback to rejection run in the worker process.
+
+        :return: this promise.
+        """
+        if self._catch is None:
+            self._catch = []
         self._catch.append(serialize_fun(func))
         return self
 
     def resolve(self, result: TPromiseResults):
-        self._result = result
-        self._results.append(result)
-        for t in self._then:
+        self._store_result(result)
+        for t in self._then or ():
             then = deserialize_fun(t, self.namespace)
             then(result)
 
@@ -58,6 +147,8 @@ class ProcessPromise(Promise):
         self._error = error
         self._state = PromiseState.rejected
         if not self._catch:
+            if self._proxy_handled:
+                return  # sent back with the outcome.
             raise UnhandledPromiseError(f"Unhandled promise exception: {self.id}") from error
         for c in self._catch:
             catch = deserialize_fun(c, self.namespace)
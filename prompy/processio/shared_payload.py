@@ -0,0 +1,161 @@
+"""
+Large payloads between processes through shared memory.
+
+:py:func:`dumps` pickles with protocol 5, the bytes, bytearray and
+out-of-band buffers (numpy arrays...) of at least `threshold` bytes are
+copied once in a :py:class:`multiprocessing.shared_memory.SharedMemory`
+segment instead of the pickle, only their names go through the queue.
+
+:py:func:`loads` unlinks the segments right away, they are freed once
+closed. bytes and bytearray are copied out, out-of-band buffers are
+loaded on the shared memory (numpy arrays are not copied), their
+segments stay mapped while used and are closed by the next calls.
+"""
+import io
+import pickle
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, List, NamedTuple, Tuple, Union
+
+# Buffers from this size are sent through shared memory.
+SHARED_THRESHOLD = 1 << 20
+
+
+class SharedPayload(NamedTuple):
+    data: bytes
+    # names and sizes of the out-of-band buffers segments.
+    segments: Tuple[Tuple[str, int], ...]
+
+
+def _share(data) -> Tuple[str, int]:
+    size = len(data)
+    segment = SharedMemory(create=True, size=size)
+    # The consumer unlinks it, its registration is balanced there.
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    try:
+        segment.buf[:size] = data
+    finally:
+        segment.close()
+    return segment.name, size
+
+
+class _Pickler(pickle.Pickler):
+
+    def __init__(self, file, threshold: int):
+        super().__init__(file, protocol=5, buffer_callback=self._buffer)
+        self.threshold = threshold
+        self.segments: List[Tuple[str, int]] = []
+        self.shared: List[Tuple[str, int]] = []
+
+    def persistent_id(self, obj):
+        # bytes and bytearray are pickled in band by the C pickler.
+        kind = type(obj)
+        if (kind is bytes or kind is bytearray) and len(obj) >= self.threshold:
+            name, size = _share(obj)
+            self.shared.append((name, size))
+            return kind is bytearray, name, size
+        return None
+
+    def _buffer(self, buffer: pickle.PickleBuffer) -> bool:
+        """:return: True to keep the buffer in the pickle."""
+        try:
+            raw = buffer.raw()
+        except BufferError:
+            return True  # not contiguous.
+        if raw.nbytes < self.threshold:
+            return True
+        self.segments.append(_share(raw))
+        return False
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def persistent_load(self, pid):
+        mutable, name, size = pid
+        segment = SharedMemory(name)
+        try:
+            data = segment.buf[:size]
+            try:
+                return bytearray(data) if mutable else bytes(data)
+            finally:
+                data.release()
+        finally:
+            segment.close()
+            segment.unlink()
+
+
+def dumps(obj: Any, threshold: int = SHARED_THRESHOLD) -> Union[bytes, SharedPayload]:
+    """
+    Pickle obj, with its large buffers in shared memory.
+
+    The payload must be given to :py:func:`loads` once to free the segments.
+
+    :param obj:
+    :param threshold: size from which the buffers are shared.
+    :return: the pickle if nothing was shared.
+    """
+    file = io.BytesIO()
+    pickler = _Pickler(file, threshold)
+    try:
+        pickler.dump(obj)
+    except BaseException:
+        _unlink(pickler.segments + pickler.shared)
+        raise
+    if not pickler.segments and not pickler.shared:
+        return file.getvalue()
+    return SharedPayload(file.getvalue(), tuple(pickler.segments))
+
+
+def _unlink(segments):
+    for name, _ in segments:
+        segment = SharedMemory(name)
+        segment.close()
+        segment.unlink()
+
+
+# Segments with views still used by loaded objects.
+_mapped: List[Tuple[SharedMemory, memoryview]] = []
+_mapped_lock = threading.Lock()
+
+
+def _close(segment: SharedMemory, view: memoryview) -> bool:
+    try:
+        view.release()
+        segment.close()
+    except BufferError:
+        return False
+    return True
+
+
+def release_unused():
+    """Close the segments not used anymore by the loaded objects."""
+    with _mapped_lock:
+        _mapped[:] = [(s, v) for s, v in _mapped if not _close(s, v)]
+
+
+def loads(payload: Union[bytes, SharedPayload]) -> Any:
+    """
+    Load a payload from :py:func:`dumps`.
+
+    :param payload:
+    :return:
+    """
+    if not isinstance(payload, SharedPayload):
+        return pickle.loads(payload)
+    release_unused()
+    segments = []
+    for name, size in payload.segments:
+        segment = SharedMemory(name)
+        # freed once closed by every process.
+        segment.unlink()
+        segments.append((segment, segment.buf[:size]))
+    try:
+        # views of their own, the loaded objects may keep them.
+        return _Unpickler(io.BytesIO(payload.data),
+                          buffers=[memoryview(view) for _, view in segments]).load()
+    finally:
+        busy = [(s, v) for s, v in segments if not _close(s, v)]
+        if busy:
+            with _mapped_lock:
+                _mapped.extend(busy)
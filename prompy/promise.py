@@ -1,17 +1,25 @@
 """Promise for python"""
 import collections
 import enum
+import itertools
+import os
+import threading
+import time
 import uuid
-from typing import Callable, Any, List, Union, Deque, TypeVar, Generic, Tuple
+from typing import Callable, Any, List, Union, Deque, TypeVar, Generic, Tuple, Optional
 
-from prompy.errors import UnhandledPromiseError, PromiseRejectionError
+from prompy import microtask
+from prompy.cancel import CancelToken
+from prompy.errors import UnhandledPromiseError, PromiseRejectionError, \
+    PromiseTimeoutError, PromiseCanceledError, PromiseError
+from prompy.timers import get_timer_service, handoff, TimerService
 
 TPromiseResults = TypeVar('PromiseReturnType')
 
 # generics don't work with callbacks, check result prop for type.
 CompleteCallback = Callable[[Union[List[TPromiseResults], TPromiseResults], Exception], None]
-ThenCallback = Callable[[TPromiseResults], None]
-CatchCallback = Callable[[Exception], None]
+ThenCallback = Callable[[TPromiseResults], Any]
+CatchCallback = Callable[[Exception], Any]
 
 PromiseStarter = Callable[[Callable, Callable], None]
 
@@ -22,6 +30,51 @@ class PromiseState(enum.Enum):
     rejected = 3
 
 
+# next() on a count is atomic under the GIL, safe to share between threads.
+_serial_counter = itertools.count()
+
+# Guard the registration of reactions against a concurrent settlement,
+# striped by serial: a lock per promise without its cost in every promise.
+_REACTIONS_LOCKS = 64
+_reactions_locks = [threading.Lock() for _ in range(_REACTIONS_LOCKS)]
+
+
+def _reset_after_fork():
+    # A thread of the parent may hold one, the child would wait forever.
+    global _reactions_locks
+    _reactions_locks = [threading.Lock() for _ in range(_REACTIONS_LOCKS)]
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Value of the timer slot of a timed out or canceled promise.
+_ABANDONED = object()
+
+def _run_reactions(calls: List[Tuple[Callable, tuple]]):
+    queue = microtask.get_queue()
+    queue.hold()
+    try:
+        for func, args in calls:
+            queue.enqueue(func, *args)
+    finally:
+        queue.release()
+
+
+def _run_on_pool(calls: List[Tuple[Callable, tuple]]):
+    # tpromise imports promise.
+    from prompy.threadio.tpromise import get_pool
+    try:
+        get_pool().add_promise(Promise(lambda resolve, _: resolve(_run_reactions(calls))))
+    except PromiseError:
+        # closed or full, run them on the handoff thread.
+        _run_reactions(calls)
+
+
+# on_fulfilled, on_rejected, derived promise
+_Reaction = Tuple[Optional[ThenCallback], Optional[CatchCallback], Optional['Promise']]
+
+
 class Promise(Generic[TPromiseResults]):
     """
     Promise interface
@@ -30,7 +83,22 @@ class Promise(Generic[TPromiseResults]):
     Basic usage:
 
     `p = Promise(lambda resolve, reject: resolve('Hello')).then(print)`
+
+    `then` and `catch` return a derived promise that settle with the
+    return value of the callback (or its error), callbacks are run from
+    the thread :py:mod:`prompy.microtask` queue.
+
+    Promises can be awaited from asyncio code, whatever thread settles them.
+
+    Promises are kept compact, callbacks lists and the results buffer
+    are only allocated when needed and the uuid is generated on demand.
     """
+    __slots__ = (
+        'canceled', 'completed_at', '_serial', '_promise_id',
+        '_reactions', '_complete', '_raise_again', '_starter',
+        '_result', '_results', '_results_buffer_size', '_has_result',
+        '_error', '_state', '_deadline', '_timer', '_token',
+    )
 
     def __init__(self, starter: PromiseStarter,
                  then: ThenCallback=None,
@@ -38,7 +106,10 @@ class Promise(Generic[TPromiseResults]):
                  complete: CompleteCallback=None,
                  raise_again: bool=False,
                  start_now: bool=False,
-                 results_buffer_size: int = 100):
+                 results_buffer_size: int = 100,
+                 timeout: float = None,
+                 deadline: float = None,
+                 cancel_token: CancelToken = None):
         """
         Promise takes at least a starter method with params to this promise
         resolve and reject. Does not call exec by default but with start_now
@@ -51,45 +122,65 @@ class Promise(Generic[TPromiseResults]):
         :param raise_again: raise the rejection error again.
         :param start_now:
         :param results_buffer_size: number of results to keep in the buffer.
+        :param timeout: seconds to settle before the promise is canceled
+            and rejected with :py:class:`~prompy.errors.PromiseTimeoutError`.
+        :param deadline: same as timeout but a `time.monotonic` time.
+        :param cancel_token: cancel the promise with this token.
         """
+        self._init_state(starter, raise_again, results_buffer_size)
+        if then is not None or catch is not None:
+            self._add_reaction(then, catch)
+        if complete is not None:
+            self._complete = [complete]
+        if timeout is not None or deadline is not None:
+            self._set_deadline(timeout, deadline)
+        if cancel_token is not None:
+            self._bind_token(cancel_token)
+        if start_now:
+            self.exec()
+
+    def _init_state(self, starter, raise_again, results_buffer_size):
         self.canceled = False
         self.completed_at = None
-        self._promise_id: uuid.UUID = uuid.uuid4()
-        self._then: List[ThenCallback] = [then] if then else []
-        self._catch: List[CatchCallback] = [catch] if catch else []
-        self._complete: List[CompleteCallback] = [complete] if complete else []
+        self._serial: int = next(_serial_counter)
+        self._promise_id: uuid.UUID = None
+        self._reactions: List[_Reaction] = None
+        self._complete: List[CompleteCallback] = None
         self._raise_again = raise_again
         self._starter = starter
         self._result: Any = None
-        self._results: Deque = collections.deque(maxlen=results_buffer_size)
+        self._results: Deque = None
+        self._results_buffer_size = results_buffer_size
+        self._has_result = False
         self._error: Exception = None
         self._state = PromiseState.pending
-        if start_now:
-            self.exec()
+        self._deadline: float = None
+        self._timer = None
+        self._token: CancelToken = None
 
-    def then(self, func: ThenCallback):
+    def then(self, func: ThenCallback, catch: CatchCallback=None) -> 'Promise':
         """
         Add a callback to resolve
 
         :param func: callback to resolve
-        :return:
+        :param catch: callback to rejection
+        :return: A promise resolved with the return value of the callback.
         """
-        self._then.append(func)
-        if self.state == PromiseState.fulfilled:
-            func(self.result)
-        return self
+        derived = self._derive()
+        self._add_reaction(func, catch, derived)
+        return derived
 
-    def catch(self, func: CatchCallback):
+    def catch(self, func: CatchCallback) -> 'Promise':
         """
         Add a callback to rejection
 
         :param func:
-        :return:
+        :return: A promise resolved with the return value of the callback,
+            or with the result of this promise if it was not rejected.
         """
-        self._catch.append(func)
-        if self.state == PromiseState.rejected:
-            func(self.error)
-        return self
+        derived = self._derive()
+        self._add_reaction(None, func, derived)
+        return derived
 
     def complete(self, func: CompleteCallback):
         """
@@ -98,6 +189,8 @@ class Promise(Generic[TPromiseResults]):
         :param func:
         :return:
         """
+        if self._complete is None:
+            self._complete = []
         self._complete.append(func)
         return self
 
@@ -108,11 +201,7 @@ class Promise(Generic[TPromiseResults]):
         :param result:
         :return:
         """
-        self._result = result  # result always the last resolved
-        self._results.append(result)
-        for t in self._then:
-            self.callback_handler(t(result))
-        self._finish(PromiseState.fulfilled)
+        self._settle(PromiseState.fulfilled, result)
 
     def reject(self, error: Exception):
         """
@@ -121,26 +210,240 @@ class Promise(Generic[TPromiseResults]):
         :param error:
         :return:
         """
-        self._error = error
-        if not self._catch:
-            self._state = PromiseState.rejected
+        if self._settle(PromiseState.rejected, error) and not self._is_handled():
             raise UnhandledPromiseError(
                 f"Unhandled promise exception: {self.id}") from error
-        for c in self._catch:
-            self.callback_handler(c(error))
-        self._finish(PromiseState.rejected)
 
-    def _finish(self, state):
+    def cancel(self, reason: Any = None):
+        """
+        Cancel the promise and its cancel token.
+
+        A pending promise is rejected with a
+        :py:class:`~prompy.errors.PromiseCanceledError`, containers skip it
+        if it's not started.
+
+        :param reason: why it's canceled.
+        :return:
+        """
+        self._cancel(reason)
+        if self._token is not None:
+            self._token.cancel(reason)
+
+    def _cancel(self, reason: Any = None):
+        self._abandon(PromiseCanceledError(reason))
+
+    def _abandon(self, error: Exception, pooled: bool=False) -> bool:
+        """
+        Cancel and reject a pending promise, the next settlements are ignored.
+
+        Not reported as unhandled, giving up on the promise is wanted.
+
+        :param pooled: run the reactions on the thread pool.
+        """
+        self.canceled = True
+        return self._settle(PromiseState.rejected, error, abandon=True, pooled=pooled)
+
+    def _bind_token(self, token: CancelToken):
+        self._token = token
+        token.on_cancel(self._cancel)
+
+    def _set_deadline(self, timeout: Optional[float], deadline: Optional[float]):
+        if timeout is not None:
+            expires = time.monotonic() + timeout
+            deadline = expires if deadline is None else min(deadline, expires)
+        self._deadline = deadline
+        timers = self._timers()
+        self._timer = timers.call_at(deadline, self._expire, isinstance(timers, TimerService))
+
+    # noinspection PyMethodMayBeStatic
+    def _timers(self):
+        """Override to use another timer service for the deadlines."""
+        return get_timer_service()
+
+    def _expire(self, pooled: bool=False):
+        """
+        Reject the promise at its deadline.
+
+        :param pooled: called by the timer thread, run the reactions on the
+            thread pool to not delay the next deadlines.
+        """
+        error = PromiseTimeoutError(f"Promise {self.id} timed out")
+        if self._settle(PromiseState.rejected, error, abandon=True, pooled=pooled):
+            # Not started yet, containers skip canceled promises.
+            self.canceled = True
+            if not self._is_handled():
+                raise UnhandledPromiseError(
+                    f"Unhandled promise exception: {self.id}") from error
+
+    def _store_result(self, result: TPromiseResults):
+        # The buffer is only needed once the promise resolve more than once.
+        if self._results is not None:
+            self._results.append(result)
+        elif self._has_result:
+            self._results = collections.deque(
+                (self._result, result), maxlen=self._results_buffer_size)
+        self._has_result = True
+        self._result = result  # result always the last resolved
+
+    def _derive(self) -> 'Promise':
+        """Create a promise without starter that is settled by this one."""
+        derived = type(self).deferred(results_buffer_size=self._results_buffer_size)
+        # Canceling a derived promise cancel the chain.
+        derived._token = self._token
+        return derived
+
+    @classmethod
+    def deferred(cls, results_buffer_size: int=100,
+                 cancel_token: CancelToken=None, **kwargs) -> 'Promise':
+        """
+        Create a pending promise without starter, to be settled from
+        outside by calling resolve or reject.
+
+        Self inserting promises (TPromise) are not inserted.
+
+        :param results_buffer_size: number of results to keep in the buffer.
+        :param cancel_token: cancel the promise with this token.
+        :param kwargs: ignored, for the subclasses.
+        :return:
+        """
+        promise = cls.__new__(cls)
+        Promise._init_state(promise, None, False, results_buffer_size)
+        if cancel_token is not None:
+            promise._bind_token(cancel_token)
+        return promise
+
+    def _add_reaction(self, on_fulfilled: Optional[ThenCallback],
+                      on_rejected: Optional[CatchCallback],
+                      derived: 'Promise'=None):
+        reaction = (on_fulfilled, on_rejected, derived)
+        with _reactions_locks[self._serial % _REACTIONS_LOCKS]:
+            if self._reactions is None:
+                self._reactions = [reaction]
+            else:
+                self._reactions.append(reaction)
+            state = self._state
+        if state == PromiseState.fulfilled:
+            # the last value, like the callbacks added before each resolve.
+            self._schedule(self._react, reaction, state, self._result)
+        elif state == PromiseState.rejected:
+            self._schedule(self._react, reaction, state, self._error)
+
+    def _settle(self, state: PromiseState, value: Any, abandon: bool=False,
+                pooled: bool=False) -> bool:
+        """
+        Store the outcome and schedule the reactions.
+
+        :param abandon: settle a pending promise for good (timed out or
+            canceled), the next settlements are ignored.
+        :param pooled: run the reactions on the thread pool, in order.
+        :return: False if the settlement was ignored.
+        """
+        with _reactions_locks[self._serial % _REACTIONS_LOCKS]:
+            timer = self._timer
+            if timer is not None:
+                if timer is _ABANDONED:
+                    return False
+                self._timer = None
+            if abandon:
+                if self._state != PromiseState.pending:
+                    return False
+                self._timer = _ABANDONED
+            if state == PromiseState.fulfilled:
+                self._store_result(value)
+            else:
+                self._error = value
+            self._state = state
+            reactions = self._reactions
+            num_reactions = len(reactions) if reactions else 0
+        if timer is not None:
+            timer.cancel()
+        if pooled:
+            calls = [(self._react, (reactions[i], state, value)) for i in range(num_reactions)]
+            if self._complete:
+                calls.append((self._run_complete, ()))
+            if calls:
+                handoff(_run_on_pool, calls)
+            return True
+        for i in range(num_reactions):
+            self._schedule(self._react, reactions[i], state, value)
+        if self._complete:
+            self._schedule(self._run_complete)
+        return True
+
+    def _react(self, reaction: _Reaction, state: PromiseState, value: Any):
+        on_fulfilled, on_rejected, derived = reaction
+        handler = on_fulfilled if state == PromiseState.fulfilled else on_rejected
+        if handler is None:
+            if derived is None:
+                return
+            if state == PromiseState.fulfilled:
+                derived.resolve(value)
+            else:
+                # Passing the error along, only the origin can be unhandled.
+                derived._settle(state, value)
+            return
+        try:
+            returned = handler(value)
+        except Exception as error:
+            if derived is None:
+                raise UnhandledPromiseError(
+                    f"Unhandled promise exception: {self.id}") from error
+            derived.reject(error)
+            return
+        if derived is not None:
+            self._resolve_derived(derived, returned)
+        else:
+            self.callback_handler(returned)
+
+    def _resolve_derived(self, derived: 'Promise', returned: Any):
+        if isinstance(returned, Promise):
+            if returned is derived:
+                return derived.reject(TypeError('Promise chaining cycle'))
+            # adopt the state of the returned promise.
+            return returned._add_reaction(None, None, derived)
+        derived.resolve(self.callback_handler(returned))
+
+    def _run_complete(self):
         for c in self._complete:
             self.callback_handler(c(self.result, self._error))
-        self._state = state
+
+    def _is_handled(self) -> bool:
+        """A rejection is handled if a catch is found down the chains."""
+        stack = [self]
+        while stack:
+            promise = stack.pop()
+            if promise._observed():
+                return True
+            for _, on_rejected, derived in promise._reactions or ():
+                if on_rejected is not None:
+                    return True
+                if derived is not None:
+                    stack.append(derived)
+        return False
+
+    # noinspection PyMethodMayBeStatic
+    def _observed(self) -> bool:
+        """Override to mark a promise as handling its own rejection."""
+        return False
+
+    # noinspection PyMethodMayBeStatic
+    def _schedule(self, func: Callable, *args):
+        """Override to run the callbacks somewhere else."""
+        microtask.get_queue().enqueue(func, *args)
 
     def exec(self):
         """
         Execute the starter method.
 
+        Callbacks of promises settled by the starter are run after it returns.
+        Derived promises have no starter and are settled by their parent.
+
         :return:
         """
+        if self._starter is None or self._timer is _ABANDONED:
+            return
+        queue = microtask.get_queue()
+        queue.hold()
         try:
             started = self._starter(self.resolve, self.reject)
             self.callback_handler(started)
@@ -149,14 +452,52 @@ class Promise(Generic[TPromiseResults]):
             if self._raise_again:
                 raise PromiseRejectionError(
                     f"Promise {self.id} was rejected") from error
+        finally:
+            queue.release()
+
+    def __await__(self):
+        """
+        Await the first outcome from a coroutine, the promise can be
+        settled from any thread, the loop is woken up when it is.
+        """
+        import asyncio
+        from prompy.futures import to_asyncio_future
+        return to_asyncio_future(self, asyncio.get_running_loop()).__await__()
 
     @property
     def id(self) -> uuid.UUID:
+        """Unique id of the promise, generated on first access."""
+        if self._promise_id is None:
+            self._promise_id = uuid.uuid4()
         return self._promise_id
 
+    @property
+    def serial(self) -> int:
+        """Cheap monotonic id, unique for the process."""
+        return self._serial
+
+    @property
+    def token(self) -> CancelToken:
+        """The cancel token of the promise, created on demand."""
+        if self._token is None:
+            self._bind_token(CancelToken())
+        return self._token
+
+    @property
+    def deadline(self) -> Optional[float]:
+        """The `time.monotonic` time the promise will time out at."""
+        return self._deadline
+
+    @property
+    def expired(self) -> bool:
+        """The deadline is passed."""
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
     @property
     def result(self) -> Union[Tuple[TPromiseResults], TPromiseResults]:
-        return tuple(self._results) if len(self._results) > 1 else self._result
+        if self._results is not None and len(self._results) > 1:
+            return tuple(self._results)
+        return self._result
 
     @property
     def error(self) -> Exception:
@@ -166,14 +507,14 @@ class Promise(Generic[TPromiseResults]):
     def state(self) -> PromiseState:
         return self._state
 
-    def callback_handler(self, obj: Any):
+    def callback_handler(self, obj: Any) -> Any:
         """
         Override to handle the return value of callbacks.
 
         :param obj: The return value of a callback
-        :return:
+        :return: The value to resolve the derived promise with.
         """
-        self._handle_generator_callback(obj)
+        return self._handle_generator_callback(obj)
 
     # noinspection PyMethodMayBeStatic
     def _handle_generator_callback(self, obj):
@@ -183,3 +524,5 @@ class Promise(Generic[TPromiseResults]):
                     next(obj)
             except StopIteration:
                 pass
+            return None
+        return obj
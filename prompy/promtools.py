@@ -1,10 +1,27 @@
-"""Methods for working with promises."""
+"""
+Methods for working with promises.
+
+The combinators (:py:func:`pall`, :py:func:`pall_settled`, :py:func:`prace`,
+:py:func:`pany`) take promises of any type that settle in this process and
+return a promise of `prom_type` with a starter that settle once enough
+promises are done, it can be started before or after. Canceling the
+combinator promise cancel the promises.
+"""
+import asyncio
+import collections
 import functools
-from typing import Callable
+import threading
+from typing import Callable, NamedTuple, Any, Optional, List, Dict, Deque, Tuple
 
 import time
 
+from prompy import microtask
+from prompy.cancel import CancelToken
+from prompy.container import BasePromiseContainer
+from prompy.errors import PromiseAggregateError, PromiseTimeoutError, PromiseError
+from prompy.function_serializer import serialize_fun
 from prompy.promise import Promise, PromiseState
+from prompy.timers import get_timer_service, handoff, TimerService
 
 
 def promise_wrap(func, prom_type=Promise, **kw) -> Callable[..., Promise]:
@@ -22,49 +39,332 @@ def promise_wrap(func, prom_type=Promise, **kw) -> Callable[..., Promise]:
     return _wrap
 
 
-class _AllPromiseWrap:
+class CacheInfo(NamedTuple):
+    """Statistics of a :py:func:`promise_cache`."""
+    hits: int
+    misses: int
+    joined: int
+    size: int
+    maxsize: int
+
+
+class _PromiseCache:
+    """
+    Single flight and LRU/TTL cache for a function returning promises.
+
+    Calls with a key already in flight get a promise derived from the
+    pending one, fulfilled results are kept until evicted, rejections
+    are never cached.
+    """
+
+    def __init__(self, func, maxsize, ttl, key):
+        self._func = func
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._key = key or _default_cache_key
+        self._lock = threading.Lock()
+        self._cache: 'collections.OrderedDict[Any, Tuple[Promise, float]]' = collections.OrderedDict()
+        self._pending: Dict[Any, Promise] = {}
+        self._hits = 0
+        self._misses = 0
+        self._joined = 0
+        functools.update_wrapper(self, func)
+
+    def __call__(self, *args, **kwargs) -> Promise:
+        key = self._key(*args, **kwargs)
+        queue = microtask.get_queue()
+        # The callbacks of a promise resolved right away must not run
+        # while the lock is taken.
+        queue.hold()
+        try:
+            with self._lock:
+                cached = self._get_cached(key)
+                if cached is None:
+                    pending = self._pending.get(key)
+                    if pending is not None:
+                        self._joined += 1
+                        return pending.then(None)
+                    self._misses += 1
+                    # Reserve the key, func is called without the lock,
+                    # it can call the cache again (recursive functions).
+                    placeholder = self._pending[key] = Promise.deferred()
+                    placeholder.complete(functools.partial(self._on_complete, key, placeholder))
+            if cached is not None:
+                # noinspection PyProtectedMember
+                derived = cached._derive()
+                derived.resolve(cached.result)
+                return derived
+        finally:
+            queue.release()
+        try:
+            promise = self._func(*args, **kwargs)
+        except Exception as error:
+            # noinspection PyProtectedMember
+            placeholder._settle(PromiseState.rejected, error)
+            raise
+        # noinspection PyProtectedMember
+        promise._add_reaction(placeholder.resolve,
+                              functools.partial(placeholder._settle, PromiseState.rejected))
+        return promise
+
+    def _get_cached(self, key) -> Optional[Promise]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        promise, expires = entry
+        if expires and expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        self._hits += 1
+        return promise
+
+    def _on_complete(self, key, promise, _, error):
+        with self._lock:
+            if self._pending.get(key) is promise:
+                del self._pending[key]
+            if error is not None or promise.state != PromiseState.fulfilled:
+                return
+            expires = time.monotonic() + self._ttl if self._ttl else 0
+            self._cache[key] = (promise, expires)
+            self._cache.move_to_end(key)
+            while self._maxsize and len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
+
+    def cache_info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._joined,
+                             len(self._cache), self._maxsize)
+
+    def cache_clear(self):
+        """Clear the cached results and the statistics, not the pending calls."""
+        with self._lock:
+            self._cache.clear()
+            self._hits = self._misses = self._joined = 0
+
+
+def _default_cache_key(*args, **kwargs):
+    if kwargs:
+        return args + tuple(sorted(kwargs.items()))
+    return args
+
+
+def promise_cache(func: Callable[..., Promise]=None, maxsize: int=128,
+                  ttl: float=None, key: Callable[..., Any]=None):
+    """
+    Cache the promises returned by func, like `functools.lru_cache`.
+
+    Concurrent calls with the same key share the pending promise and
+    fulfilled results are kept for `ttl` seconds, up to `maxsize` entries.
+    The wrapped function has `cache_info` and `cache_clear` methods.
+
+    :Example:
+
+    .. code-block:: python
+
+        get = promise_cache(urlcall.get, maxsize=256, ttl=60)
+        lookup = promise_cache(promise_wrap(lookup, prom_type=TPromise))
+
+    :param func: A function returning a promise (promise_wrap, urlcall.get)
+    :param maxsize: Max number of results to keep, 0 for unbounded.
+    :param ttl: Seconds a result is kept, None to keep until evicted.
+    :param key: Make the cache key from the args, defaults to args and sorted kwargs.
+    :return: The wrapped function or a decorator if func is not given.
+    """
+    if func is None:
+        return functools.partial(promise_cache, maxsize=maxsize, ttl=ttl, key=key)
+    return _PromiseCache(func, maxsize, ttl, key)
+
+
+class PromiseSettlement(NamedTuple):
+    """Outcome of a promise given by :py:func:`pall_settled`."""
+    state: PromiseState
+    result: Any
+    error: Optional[Exception]
+
+
+class _Combinator:
+    """
+    Starter of a combinator promise.
+
+    Reactions are added to every promise, each completion update counters
+    under a lock so the cost stays constant per promise.
+    """
+    __slots__ = ('num_promises', 'remaining', 'values', '_settled', '_lock',
+                 '_resolve', '_reject', '_outcome')
 
     def __init__(self, promises):
-        self.promises = promises
         self.num_promises = len(promises)
-        self.res = 0
-        self.rejected = False
-        self.results = []
-        self.rejection = []
+        self.remaining = self.num_promises
+        self.values: List[Any] = [None] * self.num_promises
+        self._settled = bytearray(self.num_promises)
+        self._lock = threading.Lock()
         self._resolve = None
         self._reject = None
+        self._outcome = None
+        for i, p in enumerate(promises):
+            # noinspection PyProtectedMember
+            p._add_reaction(functools.partial(self._on_fulfilled, i),
+                            functools.partial(self._on_rejected, i))
+        if not self.num_promises:
+            self._on_empty()
 
     def __call__(self, resolve, reject):
-        self._resolve = resolve
-        self._reject = reject
-        if not self.rejected and self.num_promises == self.res:
-            resolve(self.results)
-        elif sum((1 for x in self.promises if x.state == PromiseState.fulfilled)) == self.num_promises:
-            resolve([p.result for p in self.promises])
-        elif self.rejected or sum((1 for x in self.promises if x.state == PromiseState.rejected)) > 0:
-            reject(Exception("Promise all reject"))
-
-    def then(self, result):
-        self.res += 1
-        if not self.rejected:
-            self.results.append(result)
-            if self.res == self.num_promises and self._resolve:
-                self._resolve(self.results)
-
-    def catch(self, err):
-        self.rejected = True
-        if self._reject:
-            self._reject(err)
+        with self._lock:
+            self._resolve = resolve
+            self._reject = reject
+            outcome = self._outcome
+        if outcome is not None:
+            self._deliver(*outcome)
+
+    def _on_fulfilled(self, index, result):
+        raise NotImplementedError
+
+    def _on_rejected(self, index, error):
+        raise NotImplementedError
+
+    def _on_empty(self):
+        self._finish(True, [])
+
+    def _first(self, index) -> bool:
+        """Mark the promise at index as settled, False if it already was."""
+        if self._settled[index] or self._outcome is not None:
+            return False
+        self._settled[index] = 1
+        return True
+
+    def _finish(self, fulfilled, value):
+        with self._lock:
+            if self._outcome is not None:
+                return
+            self._outcome = (fulfilled, value)
+            started = self._resolve is not None
+        if started:
+            self._deliver(fulfilled, value)
+
+    def _deliver(self, fulfilled, value):
+        if fulfilled:
+            self._resolve(value)
+        else:
+            self._reject(value)
+
+
+class _All(_Combinator):
+    __slots__ = ()
+
+    def _on_fulfilled(self, index, result):
+        with self._lock:
+            if not self._first(index):
+                return
+            self.values[index] = result
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done:
+            self._finish(True, self.values)
+
+    def _on_rejected(self, index, error):
+        self._finish(False, error)
+
+
+class _AllSettled(_Combinator):
+    __slots__ = ()
+
+    def _on_fulfilled(self, index, result):
+        self._settle(index, PromiseSettlement(PromiseState.fulfilled, result, None))
+
+    def _on_rejected(self, index, error):
+        self._settle(index, PromiseSettlement(PromiseState.rejected, None, error))
+
+    def _settle(self, index, settlement):
+        with self._lock:
+            if not self._first(index):
+                return
+            self.values[index] = settlement
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done:
+            self._finish(True, self.values)
+
+
+class _Race(_Combinator):
+    __slots__ = ()
+
+    def _on_fulfilled(self, index, result):
+        self._finish(True, result)
+
+    def _on_rejected(self, index, error):
+        self._finish(False, error)
+
+    def _on_empty(self):
+        # Like js, a race without promises never settle.
+        pass
+
+
+class _Any(_Combinator):
+    __slots__ = ()
+
+    def _on_fulfilled(self, index, result):
+        self._finish(True, result)
+
+    def _on_rejected(self, index, error):
+        with self._lock:
+            if not self._first(index):
+                return
+            self.values[index] = error
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done:
+            self._on_empty()
+
+    def _on_empty(self):
+        self._finish(False, PromiseAggregateError(
+            'All promises were rejected', self.values))
+
+
+def _cancel_all(promises, reason):
+    for promise in promises:
+        promise.cancel(reason)
+
+
+def _cancel_with(promises, kwargs):
+    """Cancel the promises with the token of the combinator promise."""
+    token = kwargs.get('cancel_token')
+    if token is None:
+        token = kwargs['cancel_token'] = CancelToken()
+    token.on_cancel(functools.partial(_cancel_all, promises))
 
 
 def pall(*promises, prom_type=Promise, **kwargs) -> Promise:
-    """Wrap all the promises in a single one that resolve when all promises are done."""
-    starter = _AllPromiseWrap(promises)
+    """
+    Wrap all the promises in a single one that resolve when all promises are done.
 
-    for p in promises:
-        p.then(starter.then).catch(starter.catch)
+    Resolve with the results in the same order as the promises,
+    reject with the first error.
+    """
+    _cancel_with(promises, kwargs)
+    return prom_type(_All(promises), **kwargs)
+
+
+def pall_settled(*promises, prom_type=Promise, **kwargs) -> Promise:
+    """Resolve with a :py:class:`PromiseSettlement` for each promise once all are done."""
+    _cancel_with(promises, kwargs)
+    return prom_type(_AllSettled(promises), **kwargs)
 
-    return prom_type(starter, **kwargs)
+
+def prace(*promises, prom_type=Promise, **kwargs) -> Promise:
+    """Settle like the first of the promises to be settled."""
+    _cancel_with(promises, kwargs)
+    return prom_type(_Race(promises), **kwargs)
+
+
+def pany(*promises, prom_type=Promise, **kwargs) -> Promise:
+    """
+    Resolve with the first promise to be resolved.
+
+    Reject with a :py:class:`PromiseAggregateError` if all promises are rejected.
+    """
+    _cancel_with(promises, kwargs)
+    return prom_type(_Any(promises), **kwargs)
 
 
 def piter(func, iterable, prom_type=Promise, **kwargs) -> Promise:
@@ -76,19 +376,426 @@ def piter(func, iterable, prom_type=Promise, **kwargs) -> Promise:
     return prom_type(starter, **kwargs)
 
 
-def later(func, delay, wait_func=time.sleep, prom_type=Promise, **kwargs) -> Callable[..., Promise]:
-    """Bad, do not use."""
+def _map_starter(func, item, resolve, _):
+    resolve(func(item))
+
+
+async def _async_map_starter(func, item, resolve, _):
+    resolve(await func(item))
+
+
+def _process_map_starter(resolve, _):
+    # Run in a worker, _map_func and _map_item are in the namespace.
+    from prompy.function_serializer import deserialize_fun
+    resolve(deserialize_fun(_map_func)(_map_item))  # noqa: F821
+
+
+class _Mapper:
+    """
+    Starter of :py:func:`pmap`, keeps `concurrency` item promises in flight.
+
+    Results are emitted by one thread at a time with their callbacks run
+    in isolation, so the callbacks are called in the emitted order even
+    when the items are resolved by different threads.
+    """
+    _result, _done, _error = range(3)
+
+    def __init__(self, func, iterable, concurrency, ordered,
+                 prom_type, container, on_done, kwargs):
+        self._func = func
+        self._iterator = iter(iterable)
+        self._concurrency = max(concurrency, 1)
+        self._ordered = ordered
+        self._prom_type = prom_type
+        self._container = container
+        self._on_done = on_done
+        # items are canceled by the mapper, not each bound to the token.
+        self._kwargs = {k: v for k, v in kwargs.items() if k != 'cancel_token'}
+        self._promises: Dict[int, Promise] = {}
+        self._item_starter = _async_map_starter \
+            if asyncio.iscoroutinefunction(func) else _map_starter
+        # processio imports promtools.
+        from prompy.processio.process_containers import PromiseProcessPool
+        from prompy.processio.process_promise import ProcessPromise
+        self.process_type = None
+        if issubclass(prom_type, ProcessPromise) or isinstance(container, PromiseProcessPool):
+            if container is None:
+                raise ValueError('Process promises need a PromiseProcessPool container')
+            self.process_type = prom_type if issubclass(prom_type, ProcessPromise) else ProcessPromise
+            self._func = serialize_fun(func)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._next_index = 0
+        self._next_emit = 0
+        self._waiting: Dict[int, Any] = {}
+        self._emissions: Deque[Tuple[int, Any]] = collections.deque()
+        self._emitting = False
+        self._exhausted = False
+        self._finished = False
+        self._resolve = None
+        self._reject = None
+
+    def __call__(self, resolve, reject):
+        self._resolve = resolve
+        self._reject = reject
+        self._pump()
+
+    def _pump(self):
+        with self._lock:
+            items = []
+            try:
+                # ordered, the results waiting for a slow item are bounded too.
+                while not self._exhausted and not self._finished \
+                        and self._in_flight < self._concurrency \
+                        and len(self._waiting) < self._concurrency:
+                    try:
+                        item = next(self._iterator)
+                    except StopIteration:
+                        self._exhausted = True
+                        break
+                    items.append((self._next_index, item))
+                    self._next_index += 1
+                    self._in_flight += 1
+            except Exception as error:
+                self._finish(self._error, error)
+            if self._exhausted and not self._in_flight:
+                self._finish(self._done, self._next_index)
+        try:
+            for index, item in items:
+                self._dispatch(index, item)
+        except Exception as error:
+            self._fail(error)
+        self._flush()
+
+    def _dispatch(self, index, item):
+        if self.process_type is not None:
+            promise = self.process_type(
+                _process_map_starter, namespace={'_map_func': self._func, '_map_item': item},
+                **self._kwargs)
+            # The outcome comes back from the worker to the proxy.
+            # noinspection PyProtectedMember
+            promise.proxy._add_reaction(functools.partial(self._on_fulfilled, index),
+                                        functools.partial(self._on_rejected, index))
+        else:
+            # Callbacks are given to the constructor so they are added before
+            # a self inserting promise (TPromise) can be started.
+            promise = self._prom_type(
+                functools.partial(self._item_starter, self._func, item),
+                then=functools.partial(self._on_fulfilled, index),
+                catch=functools.partial(self._on_rejected, index), **self._kwargs)
+        with self._lock:
+            canceled = self._finished
+            if not canceled and promise.state == PromiseState.pending:
+                self._promises[index] = promise
+        if canceled:
+            promise.cancel()
+        elif self._container is not None:
+            self._container.add_promise(promise)
+        elif type(promise) is Promise:
+            promise.exec()
+
+    def cancel(self, reason):
+        """Stop mapping and cancel the items in flight."""
+        with self._lock:
+            # the pmap promise is canceled by the token.
+            self._finished = True
+            self._waiting.clear()
+            promises = list(self._promises.values())
+            self._promises.clear()
+        for promise in promises:
+            promise.cancel(reason)
+
+    def _on_rejected(self, index, error):
+        with self._lock:
+            self._promises.pop(index, None)
+        self._fail(error)
+
+    def _on_fulfilled(self, index, result):
+        with self._lock:
+            self._in_flight -= 1
+            self._promises.pop(index, None)
+            if self._finished:
+                return
+            if not self._ordered:
+                self._emissions.append((self._result, result))
+            else:
+                self._waiting[index] = result
+                while self._next_emit in self._waiting:
+                    self._emissions.append(
+                        (self._result, self._waiting.pop(self._next_emit)))
+                    self._next_emit += 1
+        self._pump()
+
+    def _fail(self, error):
+        with self._lock:
+            self._finish(self._error, error)
+        self._flush()
+
+    def _finish(self, kind, value):
+        if not self._finished:
+            self._finished = True
+            self._waiting.clear()
+            self._emissions.append((kind, value))
+
+    def _flush(self):
+        with self._lock:
+            if self._emitting:
+                return
+            self._emitting = True
+        while True:
+            with self._lock:
+                if not self._emissions:
+                    self._emitting = False
+                    return
+                kind, value = self._emissions.popleft()
+            if kind == self._result:
+                microtask.run_isolated(self._resolve, value)
+            elif kind == self._error:
+                microtask.run_isolated(self._reject, value)
+            elif self._on_done:
+                self._on_done(value)
+
+
+def pmap(func, iterable, concurrency: int=8, ordered: bool=True,
+         prom_type=Promise, container: BasePromiseContainer=None,
+         on_done: Callable[[int], None]=None, **kwargs) -> Promise:
+    """
+    Map func over iterable with at most `concurrency` promises in flight.
+
+    The iterable is consumed lazily and the returned promise resolve with
+    every result as soon as it's available (in the iterable order if
+    `ordered`). It's rejected with the first error and stop mapping,
+    canceling it cancel the items in flight.
+
+    Ordered, the results that complete after a slower earlier item wait
+    for it, at most `concurrency` of them: no item is taken while they
+    are that many. At most `2 * concurrency` items are held at once.
+
+    Item promises are of `prom_type` and added to `container` if given,
+    promises that insert themselves (TPromise, AwaitablePromise) are
+    dispatched to their pool or loop, plain promises are executed in place.
+    `func` can be a coroutine function with AwaitablePromise.
+
+    With a :py:class:`~prompy.processio.process_containers.PromiseProcessPool`
+    container the items are ProcessPromise (or `prom_type` if a subclass),
+    `func` is serialized like their starters and the items must be picklable.
+    The returned promise is a plain promise.
+
+    :param func: to apply to every item.
+    :param iterable: items to map, consumed as promises complete.
+    :param concurrency: max number of item promises in flight, and of
+        results waiting for an earlier item if `ordered`.
+    :param ordered: resolve the results in the iterable order.
+    :param prom_type: Type of the promises to instantiate.
+    :param container: PromiseQueuePool or any container to add the items promises to.
+    :param on_done: called with the number of items once all are resolved.
+    :param kwargs: kwargs of the promises initializer.
+    :return: A promise resolved with each result.
+    """
+    mapper = _Mapper(func, iterable, concurrency, ordered,
+                     prom_type, container, on_done, kwargs)
+    token = kwargs.get('cancel_token')
+    if token is None:
+        token = kwargs['cancel_token'] = CancelToken()
+    token.on_cancel(mapper.cancel)
+    if mapper.process_type is not None:
+        prom_type = Promise
+    mapper.promise = prom_type(mapper, **kwargs)
+    return mapper.promise
+
+
+def _get_timers(prom_type, kwargs):
+    # awaitable imports promtools.
+    from prompy.awaitable import AwaitablePromise
+    if issubclass(prom_type, AwaitablePromise):
+        return get_timer_service(kwargs.get('loop') or asyncio.get_event_loop())
+    return get_timer_service()
+
+
+def _call_at(timers, when: float, func, *args):
+    # the timer thread also fires the deadlines, it only hands the call off.
+    if isinstance(timers, TimerService):
+        return timers.call_at(when, handoff, func, *args)
+    return timers.call_at(when, func, *args)
+
+
+def _timer_call(func, args, kwargs, resolve, reject, prom_type, prom_kwargs):
+    def starter(res, _):
+        res(func(*args, **kwargs))
+
+    if asyncio.iscoroutinefunction(func):
+        async def starter(res, _):
+            res(await func(*args, **kwargs))
+
+    call = prom_type(starter, then=resolve, catch=reject, **prom_kwargs)
+    if type(call) is Promise:
+        # tpromise imports promtools.
+        from prompy.threadio.tpromise import get_pool
+        try:
+            get_pool().add_promise(call)
+        except PromiseError as error:
+            reject(error)
+
+
+def later(func, delay: float, wait_func: Callable[[float], None]=None,
+          prom_type=Promise, timers=None, **kwargs) -> Callable[..., Promise]:
+    """
+    Wraps func to call it after a delay.
+
+    The starter only schedule a timer, when it expires func is called
+    in a new `prom_type` promise (on the TPromise pool for plain promises).
+
+    :param func: function to call later.
+    :param delay: seconds to wait.
+    :param wait_func: blocking wait called in the starter instead of a timer.
+    :param prom_type: Type of the promises to instantiate.
+    :param timers: timer service, the global one (or the loop one for
+        AwaitablePromise) by default.
+    :param kwargs: kwargs of the promises initializer.
+    :return: A function returning a promise resolved with the return of func.
+    """
 
     @functools.wraps(func)
     def _wrap(*args, **kw):
+        if wait_func is not None:
+            def starter(resolve, reject):
+                wait_func(delay)
+                try:
+                    resolve(func(*args, **kw))
+                except Exception as err:
+                    reject(err)
+            return prom_type(starter, **kwargs)
+
+        service = _get_timers(prom_type, kwargs) if timers is None else timers
 
         def starter(resolve, reject):
-            wait_func(delay)
-            try:
-                resolve(func(*args, **kw))
-            except Exception as err:
-                reject(err)
+            _call_at(service, time.monotonic() + delay, _timer_call, func, args, kw,
+                     resolve, reject, prom_type, kwargs)
         return prom_type(starter, **kwargs)
 
     return _wrap
 
+
+class _Timeout:
+    __slots__ = ('derived', 'handle', 'done', '_lock')
+
+    def __init__(self, derived: Promise):
+        self.derived = derived
+        self.handle = None
+        self.done = False
+        self._lock = threading.Lock()
+
+    def _claim(self) -> bool:
+        with self._lock:
+            if self.done:
+                return False
+            self.done = True
+        if self.handle is not None:
+            self.handle.cancel()
+        return True
+
+    def on_fulfilled(self, result):
+        if self._claim():
+            self.derived.resolve(result)
+
+    def on_rejected(self, error):
+        if self._claim():
+            self.derived.reject(error)
+
+    def expire(self, seconds):
+        if self._claim():
+            self.derived.reject(
+                PromiseTimeoutError(f'Promise not settled after {seconds} seconds'))
+
+
+def ptimeout(promise: Promise, seconds: float, timers=None) -> Promise:
+    """
+    Settle like promise or reject with :py:class:`~prompy.errors.PromiseTimeoutError`
+    if it's still pending after seconds.
+
+    The promise itself is not cancelled.
+
+    :param promise: promise to wait for.
+    :param seconds: time to wait.
+    :param timers: timer service, the global one (or the loop one for
+        AwaitablePromise) by default.
+    :return: A promise derived from promise.
+    """
+    # noinspection PyProtectedMember
+    timeout = _Timeout(promise._derive())
+    service = timers
+    if service is None:
+        service = get_timer_service(getattr(promise, 'loop', None))
+    handle = service.call_later(seconds, timeout.expire, seconds)
+    with timeout._lock:
+        if not timeout.done:
+            timeout.handle = handle
+    if timeout.done:
+        handle.cancel()
+    # noinspection PyProtectedMember
+    promise._add_reaction(timeout.on_fulfilled, timeout.on_rejected)
+    return timeout.derived
+
+
+class _Interval:
+    __slots__ = ('func', 'interval', 'remaining', 'prom_type', 'kwargs',
+                 'timers', 'promise', '_resolve', '_reject', '_next')
+
+    def __init__(self, func, interval, count, prom_type, timers, kwargs):
+        self.func = func
+        self.interval = interval
+        self.remaining = count
+        self.prom_type = prom_type
+        self.kwargs = kwargs
+        self.timers = timers
+        self.promise: Promise = None
+        self._resolve = None
+        self._reject = None
+        self._next = 0.0
+
+    def __call__(self, resolve, reject):
+        self._resolve = resolve
+        self._reject = reject
+        self._next = time.monotonic()
+        self._schedule()
+
+    def _schedule(self):
+        # fixed rate, a slow call does not delay the next ones.
+        self._next += self.interval
+        _call_at(self.timers, self._next, self._tick)
+
+    def _tick(self):
+        promise = self.promise
+        if promise is not None and (promise.canceled or
+                                    promise.state == PromiseState.rejected):
+            return
+        if self.remaining is not None:
+            self.remaining -= 1
+        if self.remaining is None or self.remaining > 0:
+            self._schedule()
+        _timer_call(self.func, (), {}, self._resolve, self._reject,
+                    self.prom_type, self.kwargs)
+
+
+def pinterval(func: Callable[[], Any], interval: float, count: int=None,
+              prom_type=Promise, timers=None, **kwargs) -> Promise:
+    """
+    Call func every interval seconds, the promise is resolved with every
+    result and rejected with the first error.
+
+    Set `canceled` on the promise to stop it.
+
+    :param func: function to call, can be a coroutine function with AwaitablePromise.
+    :param interval: seconds between the calls.
+    :param count: stop after this many calls.
+    :param prom_type: Type of the promises to instantiate.
+    :param timers: timer service, the global one (or the loop one for
+        AwaitablePromise) by default.
+    :param kwargs: kwargs of the promises initializer.
+    :return: A promise resolved with each return of func.
+    """
+    if timers is None:
+        timers = _get_timers(prom_type, kwargs)
+    ticker = _Interval(func, interval, count, prom_type, timers, kwargs)
+    ticker.promise = prom_type(ticker, **kwargs)
+    return ticker.promise
@@ -1,30 +1,71 @@
+import functools
 import queue
 import threading
+import time
 import uuid
 
-from typing import Callable
-
-import time
+from typing import Callable, Union, List, NamedTuple, Optional, Dict
 
-from prompy.container import PromiseContainer, BasePromiseRunner
+from prompy.backpressure import QueueLimits, Capacity
+from prompy.container import PromiseContainer, BasePromiseRunner, ShutdownReport
+from prompy.errors import PromiseOverloadError, PromiseCanceledError
 from prompy.promise import Promise
+from prompy.threadio.scheduling import Scheduler, WAKE, DRAIN
 
 
 class PromiseQueue(PromiseContainer):
+    """
+    Execute promises on a thread.
+
+    The thread blocks on the queue while it's empty and stops after
+    `max_idle` seconds without promises. Promises are removed from the
+    container when they settle.
+
+    The queue is unbounded unless given `limits`, see :py:mod:`prompy.backpressure`.
+    A promise canceled while queued is removed right away, freeing its slot,
+    if the queue is bounded or the promise has a cancel token. Otherwise
+    the thread skips it.
+    """
     __thread_index = 0
 
-    def __init__(self, start=False, max_idle=0.5, on_stop: Callable = None, queue_timeout=0.01, interval=0.01,
-                 daemon=False):
+    def __init__(self, start=False, max_idle=0.5, on_stop: Callable = None, queue_timeout=None, interval=0,
+                 daemon=False, pool: 'PromiseQueuePool' = None, scheduler: Scheduler = None,
+                 limits: QueueLimits = None):
+        """
+        :param start: start the thread now.
+        :param max_idle: seconds to wait for a promise before stopping, None to wait forever.
+        :param on_stop: called with the queue when the thread stops.
+        :param queue_timeout: unused, the thread blocks until a promise or a stop.
+        :param interval: seconds to pause after each promise.
+        :param daemon: daemon thread.
+        :param pool: share the run queue of this pool with its other threads.
+        :param scheduler: order of the promises, fifo by default.
+        :param limits: capacity and overflow policy of the queue.
+        """
         super().__init__()
         self.index = PromiseQueue.__thread_index
         self._thread = threading.Thread(target=self._run, name=f"PromiseQueue-{self.index}")
         self._thread.daemon = daemon
         PromiseQueue.__thread_index += 1
-        self._queue = queue.Queue()
-        self._lock: threading.Lock = threading.Lock()
+        self._pool = pool
+        if pool is not None:
+            # noinspection PyProtectedMember
+            self._queue, self._promises, self._state_lock, self._scheduler, self._capacity, \
+                self._queued = pool._run_queue, pool._promises, pool._pool_lock, pool.scheduler, \
+                pool._capacity, pool._queued
+        else:
+            self._scheduler = scheduler or Scheduler()
+            self._capacity = Capacity(limits)
+            self._queue = self._scheduler.make_queue()
+            # serials of the queued promises, popped by who frees the slot.
+            self._queued: Dict[int, bool] = {}
+            # idle stop and additions are exclusive, no promise is left in a stopped queue.
+            self._state_lock = threading.Lock()
         self._stop_event = threading.Event()
         self._running = False
         self._idle_time = 0
+        # waiting for a promise, read by the pool without a lock.
+        self._waiting = False
         self._max_idle = max_idle
         self._started = False
         self._on_stop = on_stop
@@ -34,51 +75,115 @@ class PromiseQueue(PromiseContainer):
         if start:
             self.start()
 
-    def add_promise(self, promise: Promise):
-        super(PromiseQueue, self).add_promise(promise)
-        self._queue.put(promise.id)
+    def add_promise(self, promise: Promise, priority: int = None) -> bool:
+        """
+        Add a promise to execute.
+
+        :param promise:
+        :param priority: higher first, for the priority and deadline schedulers.
+        :return: False if the thread stopped, the promise was not added.
+        :raises PromiseOverloadError: the queue is full, the promise is rejected.
+        """
+        entry = self._scheduler.entry(promise, priority)
+        _acquire(self._capacity, promise, self._evict)
+        with self._state_lock:
+            if self._started and not self._running:
+                self._capacity.release()
+                return False
+            super(PromiseQueue, self).add_promise(promise)
+            _enqueue(self, promise)
+            self._queue.put(entry)
+        return True
+
+    def _evict(self) -> bool:
+        return _evict(self._scheduler, self._queue, self._queued, self._promises)
+
+    def _drop(self, serial: int, _reason=None):
+        _drop(self._queued, self._promises, self._capacity, serial)
 
     def _run(self):
-        self._running = True
-        idle_start = None
-        while self._running:
-            try:
-                current = self._queue.get(block=False, timeout=self._queue_timeout)
-                idle_start = None
+        pool = self._pool
+        try:
+            while True:
+                self._waiting = True
+                try:
+                    item = self._queue.get(timeout=self._max_idle)
+                except queue.Empty:
+                    with self._state_lock:
+                        if pool is not None:
+                            stop = pool._retire(self)
+                        else:
+                            stop = self._queue.empty()
+                        if stop:
+                            self._running = False
+                            break
+                    continue
+                self._waiting = False
+                if pool is not None:
+                    pool._worker_busy(item)
+                if item is WAKE:
+                    # woke up by stop.
+                    if self._stop_event.is_set():
+                        break
+                    continue
+                if item is DRAIN:
+                    break
+                current = item[1]
+                if self._queued.pop(current, None) is None:
+                    continue  # canceled in the queue, the slot is free.
+                self._capacity.release()
                 promise = self._promises[current]
-                self._lock.acquire()
-                if not promise.canceled:
+                if promise.canceled:
+                    del self._promises[current]
+                    continue
+                if self._capacity.expired(item[2]):
+                    del self._promises[current]
+                    _overload(promise, 'waited too long in the queue')
+                    continue
+                try:
                     promise.exec()
-                self._lock.release()
-                self._stop_event.wait(self._interval)
+                finally:
+                    self._release(promise)
+                if self._interval:
+                    self._stop_event.wait(self._interval)
                 if self._stop_event.is_set():
-                    self._running = False
-            except queue.Empty:
-                if not idle_start:
-                    idle_start = time.time()
-                else:
-                    idle_time = time.time() - idle_start
-                    if idle_time > self._max_idle:
-                        self._running = False
-            except Exception as e:
+                    break
+        except Exception as e:
+            self._error = e
+            raise e
+        finally:
+            self._waiting = False
+            with self._state_lock:
                 self._running = False
-                self._error = e
-                self._stopped()
-                raise e
-        self._stopped()
+            self._stopped()
 
     def start(self):
         if not self._started:
-            self._thread.start()
+            # running before the thread is, the pool check it to add promises.
+            self._running = True
             self._started = True
+            self._thread.start()
 
-    def cancel(self, cancel_id: uuid.UUID):
-        prom = self._promises.get(cancel_id)
+    def cancel(self, cancel_id: Union[int, uuid.UUID]):
+        prom = self.get_promise(cancel_id)
         if prom and not prom.canceled:
-            prom.canceled = True
+            prom.cancel()
+            self._drop(prom.serial)
 
     def stop(self):
         self._stop_event.set()
+        self._queue.put(WAKE)
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Wait for the thread to stop.
+
+        :param timeout: seconds to wait, forever by default.
+        :return: False if the thread is still running.
+        """
+        if self._started:
+            self._thread.join(timeout)
+        return not self._thread.is_alive()
 
     @property
     def running(self):
@@ -93,66 +198,266 @@ class PromiseQueue(PromiseContainer):
             self._on_stop(self)
 
 
-class PromiseQueuePool(BasePromiseRunner):
-    def __init__(self, pool_size=8, start=False, max_idle=0.5, daemon=False):
+def _acquire(capacity: Capacity, promise: Promise, evict: Callable[[], bool]):
+    try:
+        capacity.acquire(evict)
+    except PromiseOverloadError as e:
+        promise._abandon(e)
+        raise
+
+
+def _enqueue(container, promise: Promise):
+    container._queued[promise.serial] = True
+    # a token per promise is costly, only for a slot to free or a token to follow.
+    if promise._token is not None or container._capacity.limits.capacity > 0:
+        promise.token.on_cancel(functools.partial(container._drop, promise.serial))
+
+
+def _drop(queued: Dict[int, bool], promises: Dict[int, Promise], capacity: Capacity, serial: int):
+    # canceled before a worker took it, the worker skips the entry.
+    if queued.pop(serial, None) is not None:
+        promises.pop(serial, None)
+        capacity.release()
+
+
+def _evict(scheduler: Scheduler, run_queue, queued: Dict[int, bool],
+           promises: Dict[int, Promise]) -> bool:
+    while True:
+        entry = scheduler.evict(run_queue)
+        if entry is None:
+            return False
+        if queued.pop(entry[1], None) is None:
+            continue  # canceled, its slot is already free.
+        _overload(promises.pop(entry[1], None), 'dropped from a full queue')
+        return True
+
+
+def _overload(promise: Promise, why: str):
+    if promise is not None:
+        promise._abandon(PromiseOverloadError(f"Promise {promise.serial} {why}"))
+
+
+class PoolStats(NamedTuple):
+    """Counters of a :py:class:`PromiseQueuePool`."""
+    workers: int
+    idle: int
+    backlog: int
+    threads_started: int
+    threads_stopped: int
+    last_wait: float
+
+
+class PromiseQueuePool(PromiseContainer, BasePromiseRunner):
+    """
+    Threads taking the promises from a shared run queue.
+
+    A thread busy with a long promise does not delay the others, they are
+    taken by the next free thread in the order of the `scheduler`.
+
+    The number of threads adapts to the load between `min_size` and
+    `pool_size`, a thread is added when the backlog is more than the
+    idle threads or a promise waited more than `scale_up_wait` in the
+    queue. Threads above `min_size` stop after `max_idle` seconds without
+    promises, at most one every `max_idle` seconds.
+
+    The run queue is unbounded unless given `limits`, see :py:mod:`prompy.backpressure`.
+    """
+
+    def __init__(self, pool_size=8, start=False, max_idle=0.5, daemon=False,
+                 min_size: int = 0, scale_up_wait: float = 0.01, scheduler: Scheduler = None,
+                 limits: QueueLimits = None):
+        """
+        :param pool_size: max number of threads.
+        :param start: start the `min_size` threads now.
+        :param max_idle: seconds a thread above `min_size` waits before stopping.
+        :param daemon: daemon threads.
+        :param min_size: threads kept running even when idle.
+        :param scale_up_wait: add a thread when a promise waited longer in the queue.
+        :param scheduler: order of the promises, fifo by default.
+        :param limits: capacity and overflow policy of the run queue.
+        """
+        super().__init__()
         self._max_idle = max_idle
         self.pool_size = pool_size
+        self.min_size = min(min_size, pool_size)
+        self._scale_up_wait = scale_up_wait
         self._daemon = daemon
-        self._pool = queue.Queue(maxsize=pool_size)
+        self.scheduler = scheduler or Scheduler()
+        self._run_queue = self.scheduler.make_queue()
+        self._capacity = Capacity(limits)
+        self._queued: Dict[int, bool] = {}
+        self._workers: List[PromiseQueue] = []
+        self._pool_lock = threading.Lock()
+        self._stopping = False
+        self._closed = False
         self._on_thread_stop = None
+        self._last_stop = 0.0
+        self._last_wait = 0.0
+        self._threads_started = 0
+        self._threads_stopped = 0
         if start:
             self.start()
 
-    def add_promise(self, promise: Promise):
-        if self._pool.qsize() < self.pool_size:
-            self._add_queue()
-        while True:
-            pq = self._pool.get()
-            if not pq.running:
-                self._add_queue()
-            else:
-                pq.add_promise(promise)
-                self._pool.put(pq)
-                return
-
-    def _add_queue(self):
-        pq = PromiseQueue(start=True, max_idle=self._max_idle, on_stop=self._thread_stopped, daemon=self._daemon)
-        self._pool.put(pq)
+    def add_promise(self, promise: Promise, priority: int = None):
+        """
+        Add a promise to execute.
+
+        :param promise:
+        :param priority: higher first, for the priority and deadline schedulers.
+        :raises PromiseOverloadError: the queue is full, the promise is rejected.
+        :raises PromiseCanceledError: the pool is shut down, the promise is canceled.
+        """
+        if self._closed:
+            error = PromiseCanceledError('pool is shut down')
+            promise._abandon(error)
+            raise error
+        entry = self.scheduler.entry(promise, priority)
+        _acquire(self._capacity, promise, self._evict)
+        self._promises[promise.serial] = promise
+        _enqueue(self, promise)
+        self._stopping = False
+        self._run_queue.put(entry)
+        # The producers only take the lock to add a thread, a worker
+        # retiring meanwhile is replaced by `_thread_stopped`.
+        if self._needs_worker():
+            with self._pool_lock:
+                if len(self._workers) < self.min_size:
+                    self._scale_to(self.min_size)
+                elif self._needs_worker():
+                    self._add_worker()
+
+    def _needs_worker(self) -> bool:
+        if self._closed:
+            return False
+        num_workers = len(self._workers)
+        return num_workers < self.min_size or \
+            num_workers < self.pool_size and self._run_queue.qsize() > self._num_waiting()
+
+    def _num_waiting(self) -> int:
+        # no counter to update under the lock twice per promise.
+        return sum(1 for worker in self._workers if worker._waiting)
+
+    def _evict(self) -> bool:
+        return _evict(self.scheduler, self._run_queue, self._queued, self._promises)
+
+    def _drop(self, serial: int, _reason=None):
+        _drop(self._queued, self._promises, self._capacity, serial)
+
+    def _add_worker(self):
+        self._threads_started += 1
+        self._workers.append(PromiseQueue(
+            start=True, max_idle=self._max_idle, on_stop=self._thread_stopped,
+            daemon=self._daemon, pool=self))
+
+    def _scale_to(self, num_workers):
+        while len(self._workers) < num_workers:
+            self._add_worker()
+
+    def _worker_busy(self, item):
+        if item is WAKE or item is DRAIN:
+            return
+        self._last_wait = wait = time.monotonic() - item[2]
+        # the lock is only taken to add a thread.
+        if wait > self._scale_up_wait and self._needs_worker():
+            with self._pool_lock:
+                if self._needs_worker():
+                    self._add_worker()
+
+    def _retire(self, worker: PromiseQueue) -> bool:
+        """Called by an idle worker with the pool lock, True if it should stop."""
+        if worker not in self._workers:
+            return True  # the pool was stopped.
+        now = time.monotonic()
+        if not self._run_queue.empty() or len(self._workers) <= self.min_size \
+                or now - self._last_stop < self._max_idle:
+            return False
+        self._last_stop = now
+        self._workers.remove(worker)
+        return True
+
+    def cancel(self, cancel_id: Union[int, uuid.UUID]):
+        prom = self.get_promise(cancel_id)
+        if prom and not prom.canceled:
+            prom.cancel()
+            self._drop(prom.serial)
 
     def stop(self):
+        with self._pool_lock:
+            self._stopping = True
+            workers = self._workers
+            self._workers = []
+        for pq in workers:
+            pq.stop()
+
+    def shutdown(self, timeout: Optional[float] = None, cancel_pending: bool = False) -> ShutdownReport:
+        """
+        Stop taking promises, run or cancel the queued ones and wait
+        for the threads to stop.
+
+        :param timeout: seconds to drain the queue, the promises still
+            queued after are canceled. Forever by default.
+        :param cancel_pending: cancel the queued promises right away.
+        :return: what was not done.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._pool_lock:
+            self._closed = self._stopping = True
+            workers = list(self._workers)
+        canceled = self._cancel_queued() if cancel_pending else []
+        for _ in workers:
+            self._run_queue.put(DRAIN)
+        for worker in workers:
+            worker.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        canceled.extend(self._cancel_queued())
+        unjoined = [w for w in workers if not w.join(0)]
+        for worker in unjoined:
+            worker.stop()
+        with self._pool_lock:
+            self._workers = []
+        return ShutdownReport(not canceled and not unjoined, tuple(canceled), len(unjoined))
+
+    def _cancel_queued(self) -> List[Promise]:
+        canceled = []
         while True:
             try:
-                pq = self._pool.get()
-                pq.stop()
+                entry = self._run_queue.get_nowait()
             except queue.Empty:
-                break
+                return canceled
+            if entry is WAKE or entry is DRAIN or self._queued.pop(entry[1], None) is None:
+                continue
+            self._capacity.release()
+            with self._pool_lock:
+                promise = self._promises.pop(entry[1], None)
+            if promise is not None and not promise.canceled:
+                promise.cancel('pool is shut down')
+                canceled.append(promise)
 
     def start(self):
-        while self._pool.qsize() < self.pool_size:
-            try:
-                self._add_queue()
-            except queue.Full:
-                return
+        with self._pool_lock:
+            self._closed = self._stopping = False
+            self._scale_to(self.min_size)
 
     def is_running(self):
-        running = []
-        while True:
-            try:
-                pq = self._pool.get_nowait()
-                if pq.running:
-                    running.append(pq)
-            except queue.Empty:
-                break
-
-        is_running = len(running) > 0
-        for r in running:
-            self._pool.put_nowait(r)
+        with self._pool_lock:
+            return any(w.running for w in self._workers)
 
-        return is_running
+    def stats(self) -> PoolStats:
+        with self._pool_lock:
+            return PoolStats(len(self._workers), self._num_waiting(), self._run_queue.qsize(),
+                             self._threads_started, self._threads_stopped,
+                             self._last_wait)
 
     def on_thread_stop(self, func):
         self._on_thread_stop = func
 
     def _thread_stopped(self, t):
+        with self._pool_lock:
+            self._threads_stopped += 1
+            if t in self._workers:
+                self._workers.remove(t)
+            # replace a thread stopped by an error.
+            if not self._stopping and not self._run_queue.empty() \
+                    and len(self._workers) < self.pool_size:
+                self._add_worker()
         if self._on_thread_stop:
             self._on_thread_stop(t)
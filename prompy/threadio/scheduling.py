@@ -0,0 +1,107 @@
+"""
+Order of the promises in a :py:class:`~prompy.threadio.promise_queue.PromiseQueue`.
+
+* fifo - in the order they were added.
+* priority - higher `priority` first.
+* deadline - earliest `deadline` first (see the promise `timeout` and `deadline`).
+
+With `aging`, a priority level is worth `aging` seconds of waiting: a
+promise waits at most `aging` seconds per level of difference behind
+promises of higher priority, low priority work is not starved.
+"""
+import enum
+import heapq
+import queue
+import time
+from typing import Tuple, Any, Optional, Union
+
+from prompy.promise import Promise
+
+# (sort key, promise serial, enqueue time)
+QueueEntry = Tuple[Any, int, float]
+
+# Wakes an idle thread, sorted before any promise.
+WAKE: QueueEntry = ((float('-inf'),), -1, 0.0)
+
+# Stops a thread once the promises before it ran, sorted after any promise.
+DRAIN: QueueEntry = ((float('inf'),), -1, 0.0)
+
+
+class SchedulingPolicy(enum.Enum):
+    fifo = 'fifo'
+    priority = 'priority'
+    deadline = 'deadline'
+
+
+class Scheduler:
+    """Make the run queue and its entries for a scheduling policy."""
+    __slots__ = ('policy', 'aging', 'default_deadline')
+
+    def __init__(self, policy: SchedulingPolicy = SchedulingPolicy.fifo,
+                 aging: float = 0.1, default_deadline: float = 1.0):
+        """
+        :param policy: how the promises are ordered.
+        :param aging: seconds of waiting a priority level is worth,
+            None for strict priorities that can starve the low ones.
+        :param default_deadline: seconds from the insertion used as the
+            deadline of promises without one with the deadline policy.
+        """
+        self.policy = SchedulingPolicy(policy)
+        self.aging = aging
+        self.default_deadline = default_deadline
+
+    def make_queue(self) -> Union[queue.SimpleQueue, queue.PriorityQueue]:
+        if self.policy == SchedulingPolicy.fifo:
+            # no lock to take in python code, the fastest to submit to.
+            return queue.SimpleQueue()
+        return queue.PriorityQueue()
+
+    def entry(self, promise: Promise, priority: int = None) -> QueueEntry:
+        """
+        :param promise: promise to queue.
+        :param priority: priority of the promise, its `priority` attribute by default.
+        :return: the entry to put in the queue.
+        """
+        now = time.monotonic()
+        policy = self.policy
+        if policy == SchedulingPolicy.fifo:
+            return (), promise.serial, now
+        if priority is None:
+            priority = getattr(promise, 'priority', 0)
+        start = now
+        if policy == SchedulingPolicy.deadline:
+            deadline = promise.deadline
+            start = now + self.default_deadline if deadline is None else deadline
+        if self.aging is None:
+            return (-priority, start), promise.serial, now
+        return (start - priority * self.aging,), promise.serial, now
+
+    def evict(self, run_queue: Union[queue.SimpleQueue, queue.PriorityQueue]) -> Optional[QueueEntry]:
+        """
+        Remove the entry of the promise that would run first (fifo) or
+        last (priority and deadline) from a full queue.
+
+        :param run_queue: a queue made by `make_queue`.
+        :return: the removed entry, None if there is no promise to remove.
+        """
+        if self.policy == SchedulingPolicy.fifo:
+            try:
+                entry = run_queue.get_nowait()
+            except queue.Empty:
+                return None
+            if entry is WAKE or entry is DRAIN:
+                run_queue.put(entry)
+                return None
+            return entry
+        with run_queue.mutex:
+            entries = run_queue.queue
+            if not entries:
+                return None
+            index = max(range(len(entries)), key=entries.__getitem__)
+            entry = entries[index]
+            if entry is WAKE or entry is DRAIN:
+                return None
+            entries[index] = entries[-1]
+            entries.pop()
+            heapq.heapify(entries)
+        return entry
@@ -3,39 +3,115 @@ Threaded Promise
 
 Auto insert in a global thread pool.
 
+The pool is created on first use, again in the children after a fork,
+and replaced at runtime with :py:func:`configure`.
+
 Use the following environ vars:
 
 * PROMPY_THREAD_POOL_SIZE=2
+* PROMPY_THREAD_POOL_MIN=0
 * PROMPY_THREAD_IDLE_TIME=0.5
 * PROMPY_THREAD_DAEMON=false
+* PROMPY_THREAD_SCHEDULING=fifo (fifo, priority or deadline)
+* PROMPY_THREAD_QUEUE_CAPACITY=0 (unbounded)
+* PROMPY_THREAD_QUEUE_OVERFLOW=block (block, reject or drop_oldest)
+* PROMPY_THREAD_QUEUE_MAX_WAIT= (seconds, shed the promises that waited longer)
 """
 import os
+import threading
 
+from prompy.backpressure import QueueLimits, OverflowPolicy
 from prompy.promise import Promise
 from prompy.promtools import promise_wrap
 from prompy.threadio.promise_queue import PromiseQueuePool
+from prompy.threadio.scheduling import Scheduler
 
 # GLOBAL THREAD POOL
 
-_pool_size = int(os.getenv('PROMPY_THREAD_POOL_SIZE', '2'))
-_idle_time = float(os.getenv('PROMPY_THREAD_IDLE_TIME', '0.5'))
-_daemon = os.getenv('PROMPY_THREAD_DAEMON', 'false') == 'true'
+_prom_pool: PromiseQueuePool = None
+_pool_options: dict = {}
+_pool_lock = threading.Lock()
+
+
+def _environ_options() -> dict:
+    max_wait = os.getenv('PROMPY_THREAD_QUEUE_MAX_WAIT')
+    return dict(
+        pool_size=int(os.getenv('PROMPY_THREAD_POOL_SIZE', '2')),
+        min_size=int(os.getenv('PROMPY_THREAD_POOL_MIN', '0')),
+        max_idle=float(os.getenv('PROMPY_THREAD_IDLE_TIME', '0.5')),
+        daemon=os.getenv('PROMPY_THREAD_DAEMON', 'false') == 'true',
+        scheduler=Scheduler(os.getenv('PROMPY_THREAD_SCHEDULING', 'fifo')),
+        limits=QueueLimits(
+            capacity=int(os.getenv('PROMPY_THREAD_QUEUE_CAPACITY', '0')),
+            overflow=OverflowPolicy(os.getenv('PROMPY_THREAD_QUEUE_OVERFLOW', 'block')),
+            max_wait=float(max_wait) if max_wait else None))
+
+
+def get_pool() -> PromiseQueuePool:
+    """The global pool of the TPromise, created on first use."""
+    global _prom_pool
+    if _prom_pool is None:
+        with _pool_lock:
+            if _prom_pool is None:
+                _prom_pool = PromiseQueuePool(**{**_environ_options(), **_pool_options})
+    return _prom_pool
+
+
+def configure(**options):
+    """
+    Replace the global pool with a new one.
+
+    The promises already in the previous pool still run, its threads
+    stop once idle.
 
-_prom_pool = PromiseQueuePool(
-    pool_size=_pool_size, max_idle=_idle_time, daemon=_daemon)
+    :param options: :py:class:`~prompy.threadio.promise_queue.PromiseQueuePool`
+        arguments, the environ vars for the others.
+    :return:
+    """
+    global _prom_pool
+    with _pool_lock:
+        previous = _prom_pool
+        _pool_options.clear()
+        _pool_options.update(options)
+        _prom_pool = None
+    if previous is not None:
+        previous.min_size = 0
+
+
+def _reset_after_fork():
+    # The threads of the parent pool don't exist in the child.
+    global _prom_pool, _pool_lock
+    _prom_pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 class TPromise(Promise):
-    """A promise with auto insert in a threadio.PromiseQueue."""
-    __promise_pool = _prom_pool
+    """
+    A promise with auto insert in a threadio.PromiseQueue.
 
-    def __init__(self, starter, *args, **kwargs):
+    The `priority` orders the promises with the priority and deadline schedulers.
+    """
+    __slots__ = ('priority',)
+
+    def __init__(self, starter, *args, priority: int = 0, **kwargs):
+        self.priority = priority
         super().__init__(starter, *args, **kwargs)
-        self.__promise_pool.add_promise(self)
+        get_pool().add_promise(self, priority)
+
+    @classmethod
+    def deferred(cls, results_buffer_size: int = 100, priority: int = 0, **kwargs):
+        promise = super().deferred(results_buffer_size, **kwargs)
+        promise.priority = priority
+        return promise
 
     @classmethod
     def stop_queue(cls):
-        cls.__promise_pool.stop()
+        if _prom_pool is not None:
+            _prom_pool.stop()
 
     @classmethod
     def wrap(cls, func):
@@ -0,0 +1,259 @@
+"""
+Timer services, call functions later without a sleeping thread per call.
+
+* :py:class:`TimerService` - a heap of timers run by one background thread.
+* :py:class:`LoopTimerService` - timers of an asyncio loop.
+
+Timer callbacks run on the timer thread (or the loop), they should be
+short and hand the work to a pool or a loop, :py:func:`handoff` runs
+the callbacks that may block on another thread.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Callable, List, Tuple, Optional
+
+
+class TimerHandle:
+    """A scheduled call, cancel it before it's due to prevent the call."""
+    __slots__ = ('when', 'func', 'args', 'cancelled', '_service')
+
+    def __init__(self, when: float, func: Callable, args: tuple, service):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+        self._service = service
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            service = self._service
+            if service is not None:
+                service._timer_cancelled(self)
+            else:
+                self.func = self.args = None
+
+
+class TimerService:
+    """
+    Run timers from a heap on a single daemon thread.
+
+    Cancelled timers are left in the heap and skipped, the heap is
+    rebuilt when they are more than half of it.
+    """
+
+    def __init__(self, name: str = 'PromiseTimer',
+                 on_error: Callable[[Exception], None] = None):
+        """
+        :param name: name of the timer thread.
+        :param on_error: called with the errors raised by the timers callbacks.
+        """
+        self._name = name
+        self._on_error = on_error
+        self._heap: List[Tuple[float, int, TimerHandle]] = []
+        self._condition = threading.Condition(threading.Lock())
+        self._sequence = itertools.count()
+        self._num_cancelled = 0
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    def call_at(self, when: float, func: Callable, *args) -> TimerHandle:
+        """
+        Call func with args at a `time.monotonic` time.
+
+        :return: handle to cancel the call.
+        """
+        handle = TimerHandle(when, func, args, self)
+        with self._condition:
+            heapq.heappush(self._heap, (when, next(self._sequence), handle))
+            if not self._running:
+                self._start()
+            elif self._heap[0][2] is handle:
+                self._condition.notify()
+        return handle
+
+    def call_later(self, delay: float, func: Callable, *args) -> TimerHandle:
+        """
+        Call func with args after delay seconds.
+
+        :return: handle to cancel the call.
+        """
+        return self.call_at(time.monotonic() + delay, func, *args)
+
+    def stop(self):
+        """Stop the timer thread, pending timers are kept for the next start."""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def _start(self):
+        # with the lock, a stopped thread still exiting sees it's replaced.
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self._name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        heap = self._heap
+        me = threading.current_thread()
+        while True:
+            due = []
+            with self._condition:
+                # stopped, or replaced by a start while this thread was exiting.
+                while self._running and self._thread is me:
+                    if not heap:
+                        self._condition.wait()
+                        continue
+                    now = time.monotonic()
+                    when = heap[0][0]
+                    if when > now:
+                        self._condition.wait(when - now)
+                        continue
+                    while heap and heap[0][0] <= now:
+                        handle = heapq.heappop(heap)[2]
+                        if handle.cancelled:
+                            self._num_cancelled -= 1
+                        else:
+                            # copied before it's unlinked, a cancel from now on is too late.
+                            due.append((handle.func, handle.args))
+                            handle._service = None
+                    if due:
+                        break
+                if not self._running or self._thread is not me:
+                    return
+            for func, args in due:
+                try:
+                    func(*args)
+                except Exception as error:
+                    self._error(error)
+
+    def _timer_cancelled(self, handle: TimerHandle):
+        with self._condition:
+            if handle._service is None:
+                return  # already due, the timer thread has its call.
+            handle.func = handle.args = None
+            self._num_cancelled += 1
+            if self._num_cancelled > 64 and self._num_cancelled * 2 > len(self._heap):
+                self._heap[:] = [x for x in self._heap if not x[2].cancelled]
+                heapq.heapify(self._heap)
+                self._num_cancelled = 0
+
+    def _error(self, error: Exception):
+        if self._on_error:
+            self._on_error(error)
+        else:
+            sys.excepthook(type(error), error, error.__traceback__)
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def __len__(self):
+        """Number of pending timers."""
+        return len(self._heap) - self._num_cancelled
+
+
+class _LoopTimerHandle:
+    __slots__ = ('cancelled', 'handle')
+
+    def __init__(self):
+        self.cancelled = False
+        self.handle: asyncio.TimerHandle = None
+
+    def cancel(self):
+        self.cancelled = True
+        if self.handle is not None:
+            self.handle.cancel()
+
+
+class LoopTimerService:
+    """Timers of an asyncio loop, can be used from any thread."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def call_at(self, when: float, func: Callable, *args):
+        """Call func with args at a `time.monotonic` time."""
+        return self.call_later(when - time.monotonic(), func, *args)
+
+    def call_later(self, delay: float, func: Callable, *args):
+        """Call func with args on the loop after delay seconds."""
+        handle = _LoopTimerHandle()
+        self.loop.call_soon_threadsafe(self._schedule, handle, delay, func, args)
+        return handle
+
+    def _schedule(self, handle: _LoopTimerHandle, delay, func, args):
+        if not handle.cancelled:
+            handle.handle = self.loop.call_later(delay, func, *args)
+
+
+_timer_service: Optional[TimerService] = None
+_timer_service_lock = threading.Lock()
+
+
+def get_timer_service(loop: asyncio.AbstractEventLoop = None):
+    """
+    The global timer service or the timer service of a loop.
+
+    :param loop: get a :py:class:`LoopTimerService` for this loop.
+    :return:
+    """
+    global _timer_service
+    if loop is not None:
+        return LoopTimerService(loop)
+    if _timer_service is None:
+        with _timer_service_lock:
+            if _timer_service is None:
+                _timer_service = TimerService()
+    return _timer_service
+
+
+_handoff_queue: Optional[queue.SimpleQueue] = None
+_handoff_lock = threading.Lock()
+
+
+def handoff(func: Callable, *args):
+    """
+    Call func with args on the handoff thread, never blocks.
+
+    For timer callbacks that may block (adding to a bounded queue...),
+    the deadlines of the timer thread are not delayed by them.
+    """
+    global _handoff_queue
+    if _handoff_queue is None:
+        with _handoff_lock:
+            if _handoff_queue is None:
+                calls = queue.SimpleQueue()
+                thread = threading.Thread(target=_run_handoff, args=(calls,), name='PromiseHandoff')
+                thread.daemon = True
+                thread.start()
+                _handoff_queue = calls
+    _handoff_queue.put((func, args))
+
+
+def _run_handoff(calls: queue.SimpleQueue):
+    while True:
+        func, args = calls.get()
+        try:
+            func(*args)
+        except Exception as error:
+            sys.excepthook(type(error), error, error.__traceback__)
+
+
+def _reset_after_fork():
+    # The timer and handoff threads of the parent don't exist in the child.
+    global _timer_service, _timer_service_lock, _handoff_queue, _handoff_lock
+    _timer_service = None
+    _timer_service_lock = threading.Lock()
+    _handoff_queue = None
+    _handoff_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
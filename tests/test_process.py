@@ -1,9 +1,27 @@
+import gc
+import os
+import pickle
+import subprocess
+import sys
+import textwrap
+import threading
 import unittest
 import time
+import weakref
 
 from prompy.processio.process_promise import ProcessPromise
 from prompy.processio.process_containers import PromiseProcessPool
-from prompy.errors import UnhandledPromiseError
+from prompy.errors import UnhandledPromiseError, PromiseCanceledError, PromiseTimeoutError
+from prompy.promise import Promise
+from prompy.promtools import pmap
+from prompy.futures import PromiseExecutor
+from prompy.function_serializer import serialize_fun, deserialize_fun
+from prompy.processio import shared_payload
+from prompy.backpressure import QueueLimits, OverflowPolicy
+
+
+class _Payload:
+    pass
 
 
 class TestProcess(unittest.TestCase):
@@ -43,6 +61,306 @@ class TestProcess(unittest.TestCase):
             else:
                 raise error
 
+    def test_deserialize_cache(self):
+        def add(x, y=1):
+            return x + y
+
+        def count():
+            global calls
+            calls = globals().get('calls', 0) + 1
+            return calls
+
+        serialized = serialize_fun(add)
+        function = deserialize_fun(serialized)
+        self.assertIs(function.__code__, deserialize_fun(serialize_fun(add)).__code__)
+        self.assertEqual(3, function(2))
+        # each call has its own globals, the cache keeps no namespace alive.
+        payload = _Payload()
+        ref = weakref.ref(payload)
+        deserialize_fun(serialized, namespace={'payload': payload})
+        del payload
+        gc.collect()
+        self.assertIsNone(ref())
+        serialized = serialize_fun(count)
+        self.assertEqual(1, deserialize_fun(serialized)())
+        self.assertEqual(1, deserialize_fun(serialized)())
+
+    def test_process_results(self):
+        def compute(resolve, _):
+            resolve(21 * 2)
+
+        def fail(_, __):
+            raise ValueError('failed in the worker')
+
+        # handled by the proxy, the worker does not stop on the error.
+        pool = PromiseProcessPool(pool_size=1)
+        failed = ProcessPromise(fail)
+        computed = ProcessPromise(compute)
+        results = []
+        errors = []
+        computed.proxy.then(results.append)
+        failed.proxy.catch(errors.append)
+        pool.add_promises(failed, computed)
+        pool.shutdown(timeout=10)
+        self.assertEqual([42], results)
+        self.assertIsInstance(errors[0], ValueError)
+        self.assertEqual(0, pool.restarts)
+        self.assertEqual([], list(pool.get_errors()))
+
+    def test_shared_payload(self):
+        big = b'x' * (2 << 20)
+        has_shm = os.path.isdir('/dev/shm')
+        before = set(os.listdir('/dev/shm')) if has_shm else None
+        payload = shared_payload.dumps((big, bytearray(big), b'small'))
+        self.assertLess(len(payload.data), 1024)
+        self.assertEqual((big, bytearray(big), b'small'), shared_payload.loads(payload))
+
+        # out-of-band buffers are loaded without a copy, mapped while used.
+        view = shared_payload.loads(shared_payload.dumps(pickle.PickleBuffer(bytearray(big))))
+        self.assertEqual(big, bytes(view))
+        self.assertEqual(1, len(shared_payload._mapped))
+        view.release()
+        shared_payload.release_unused()
+        self.assertEqual(0, len(shared_payload._mapped))
+        if has_shm:
+            self.assertEqual(before, set(os.listdir('/dev/shm')))
+
+        def big_result(resolve, _):
+            resolve(b'x' * (2 << 20))
+
+        pool = PromiseProcessPool(pool_size=1)
+        promise = ProcessPromise(big_result)
+        results = []
+        promise.proxy.then(results.append)
+        pool.add_promise(promise)
+        pool.shutdown(timeout=10)
+        self.assertEqual([big], results)
+
+        # a new interpreter, the resource trackers report unbalanced segments at exit.
+        script = textwrap.dedent('''
+            from prompy.processio.process_containers import PromiseProcessPool
+            from prompy.processio.process_promise import ProcessPromise
+
+            def big_result(resolve, _):
+                resolve(len(payload) * b'x')
+
+            # forked before any segment, each process has its own tracker.
+            pool = PromiseProcessPool(pool_size=1)
+            pool.start()
+            promise = ProcessPromise(big_result, namespace={'payload': b'x' * (2 << 20)})
+            pool.add_promise(promise)
+            pool.shutdown(timeout=10)
+        ''')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        child = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                               timeout=60, env={**os.environ, 'PYTHONPATH': root})
+        self.assertEqual(0, child.returncode, child.stderr)
+        self.assertNotIn('resource_tracker', child.stderr)
+
+    def test_process_pool_shutdown(self):
+        def slow_task(resolve, _):
+            import time
+            time.sleep(0.2)
+            resolve(None)
+
+        def hung_task(resolve, _):
+            import time
+            time.sleep(10)
+            resolve(None)
+
+        pool = PromiseProcessPool(pool_size=1)
+        pool.add_promises(*(ProcessPromise(slow_task) for _ in range(3)))
+        report = pool.shutdown(timeout=10)
+        self.assertTrue(report.drained)
+        self.assertRaises(PromiseCanceledError, pool.add_promise, ProcessPromise(slow_task))
+
+        pool = PromiseProcessPool(pool_size=1)
+        queued = [ProcessPromise(slow_task) for _ in range(2)]
+        pool.add_promises(ProcessPromise(hung_task), *queued)
+        time.sleep(0.5)
+        report = pool.shutdown(timeout=0.2)
+        self.assertFalse(report.drained)
+        self.assertEqual(1, report.unjoined)
+        self.assertEqual({p.id for p in queued}, {p.id for p in report.canceled})
+
+        # stopped with shared payloads still queued, their segments are unlinked.
+        if os.path.isdir('/dev/shm'):
+            before = set(os.listdir('/dev/shm'))
+            pool = PromiseProcessPool(pool_size=1)
+            pool.add_promise(ProcessPromise(hung_task))
+            pool.add_promises(*(ProcessPromise(slow_task, namespace={'payload': b'x' * (2 << 20)})
+                                for _ in range(3)))
+            time.sleep(0.5)
+            pool.stop()
+            self.assertEqual(before, set(os.listdir('/dev/shm')))
+
+    def test_process_pool_health(self):
+        def crash(_, __):
+            import os
+            os._exit(3)
+
+        def hang(_, __):
+            import time
+            time.sleep(10)
+
+        def compute(resolve, _):
+            resolve(42)
+
+        pool = PromiseProcessPool(pool_size=1, health_interval=0.05, stuck_timeout=0.5)
+        crashed = ProcessPromise(crash)
+        hung = ProcessPromise(hang)
+        queued = ProcessPromise(compute)
+        errors = []
+        results = []
+        crashed.proxy.catch(errors.append)
+        hung.proxy.catch(errors.append)
+        queued.proxy.then(results.append)
+        pool.add_promises(crashed, hung, queued)
+        deadline = time.monotonic() + 20
+        while (not results or len(errors) < 2) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        pool.shutdown(timeout=10)
+        # crashed twice, hung twice, the queued promise is sent again each time.
+        self.assertEqual(4, pool.restarts)
+        self.assertEqual([42], results)
+        self.assertEqual(2, len(errors))
+        self.assertIn('lost with its worker', str(errors[0]))
+
+    def test_process_pool_batches(self):
+        def compute(resolve, _):
+            resolve(42)
+
+        pool = PromiseProcessPool(pool_size=2, batch_size=50, batch_window=0.01)
+        results = []
+        for _ in range(120):
+            promise = ProcessPromise(compute)
+            promise.proxy.then(results.append)
+            pool.add_promise(promise)
+        chunked = [ProcessPromise(compute) for _ in range(100)]
+        for promise in chunked:
+            promise.proxy.then(results.append)
+        pool.add_promises(*chunked, chunksize=30)
+        deadline = time.monotonic() + 20
+        while pool.num_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        report = pool.shutdown(timeout=10)
+        self.assertTrue(report.drained)
+        self.assertEqual([42] * 220, results)
+
+    def test_process_pool_bounded_batches(self):
+        def compute(resolve, _):
+            resolve(42)
+
+        pool = PromiseProcessPool(pool_size=1, queue_options={
+            'limits': QueueLimits(4, OverflowPolicy.block)})
+        pool.start()
+        results = []
+        lock = threading.Lock()
+
+        def produce():
+            promises = [ProcessPromise(compute) for _ in range(4)]
+            for promise in promises:
+                promise.proxy.then(results.append)
+            with lock:
+                pass
+            pool.add_promises(*promises, chunksize=4)
+
+        with lock:
+            producers = [threading.Thread(target=produce) for _ in range(8)]
+            for producer in producers:
+                producer.start()
+        for producer in producers:
+            producer.join(10)
+        self.assertFalse(any(producer.is_alive() for producer in producers))
+        report = pool.shutdown(timeout=10)
+        self.assertTrue(report.drained)
+        self.assertEqual([42] * 32, results)
+
+        # canceled in the queue, the slots are free right away.
+        def slow(resolve, _):
+            import time
+            time.sleep(0.5)
+            resolve(None)
+
+        pool = PromiseProcessPool(pool_size=1, queue_options={
+            'limits': QueueLimits(2, OverflowPolicy.reject)})
+        pool.add_promise(ProcessPromise(slow))
+        time.sleep(0.2)
+        canceled = [ProcessPromise(compute) for _ in range(2)]
+        pool.add_promises(*canceled, chunksize=1)
+        for promise in canceled:
+            promise.cancel()
+        queued = [ProcessPromise(compute) for _ in range(2)]
+        results = []
+        for promise in queued:
+            promise.proxy.then(results.append)
+        pool.add_promises(*queued, chunksize=1)
+        report = pool.shutdown(timeout=10)
+        self.assertTrue(report.drained)
+        self.assertEqual([42] * 2, results)
+        self.assertTrue(all(promise.proxy.canceled for promise in canceled))
+
+    def test_process_pool_batch_window(self):
+        def slow(resolve, _):
+            import time
+            time.sleep(1)
+            resolve(None)
+
+        # the window expires with a full queue, the timer thread must not wait.
+        pool = PromiseProcessPool(pool_size=1, batch_size=10, batch_window=0.01, queue_options={
+            'limits': QueueLimits(1, OverflowPolicy.block)})
+        pool.start()
+        pool.add_promises(ProcessPromise(slow), ProcessPromise(slow), chunksize=1)
+        pool.add_promise(ProcessPromise(slow))
+        errors = []
+        unrelated = Promise(lambda resolve, _: None, timeout=0.2)
+        unrelated.catch(errors.append)
+        unrelated.exec()
+        time.sleep(0.5)
+        self.assertIsInstance(errors[0], PromiseTimeoutError)
+        pool.shutdown(timeout=10)
+
+    def test_process_pmap(self):
+        pool = PromiseProcessPool(pool_size=2)
+        results = []
+        done = threading.Event()
+        mapped = pmap(lambda x: x * x, range(20), concurrency=4, container=pool,
+                      on_done=lambda _: done.set())
+        mapped.then(results.append)
+        mapped.exec()
+        self.assertTrue(done.wait(10))
+        pool.shutdown(timeout=10)
+        self.assertEqual([x * x for x in range(20)], results)
+
+    def test_process_executor(self):
+        # default options, the errors of the calls don't stop the workers.
+        pool = PromiseProcessPool(pool_size=2)
+        with PromiseExecutor(pool) as executor:
+            self.assertEqual(1024, executor.submit(lambda x, y=1: x ** y, 2, y=10).result(10))
+            failed = [executor.submit(lambda x: 1 / x, 0) for _ in range(2)]
+            for future in failed:
+                self.assertIsInstance(future.exception(10), ZeroDivisionError)
+            self.assertEqual([x + 1 for x in range(10)],
+                             list(executor.map(lambda x: x + 1, range(10), chunksize=3, timeout=10)))
+        pool.shutdown(timeout=10)
+        self.assertEqual((0, 0), (pool.restarts, pool.requeued))
+
+    def test_process_timeout(self):
+        def hang(resolve, _):
+            import time
+            time.sleep(1)
+            resolve('late')
+
+        pool = PromiseProcessPool(pool_size=1)
+        promise = ProcessPromise(hang, timeout=0.3)
+        outcomes = []
+        promise.proxy.then(outcomes.append).catch(outcomes.append)
+        pool.add_promise(promise)
+        time.sleep(0.6)
+        self.assertIsInstance(outcomes[0], PromiseTimeoutError)
+        pool.shutdown(timeout=10)
+        self.assertEqual(1, len(outcomes))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,13 +1,31 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import os
 import time
 import functools
+import multiprocessing
+import threading
 import unittest
 
-from prompy.threadio.tpromise import TPromise, _prom_pool
+from prompy.threadio.tpromise import TPromise, get_pool
 
-from prompy.promtools import pall, piter
+from prompy import microtask, promise as promise_module
+from prompy.backpressure import QueueLimits
+from prompy.batcher import PromiseBatcher
+from prompy.cancel import CancelToken
+from prompy.futures import PromiseExecutor, to_future, from_future, to_asyncio_future
+from prompy.errors import UnhandledPromiseError, PromiseAggregateError, PromiseTimeoutError, \
+    PromiseCanceledError, PromiseOverloadError
+from prompy.promise import Promise, PromiseState
+from prompy.promtools import pall, piter, pall_settled, prace, pany, pmap, \
+    promise_cache, promise_wrap, later, ptimeout, pinterval
+from prompy.threadio.promise_queue import PromiseQueue, PromiseQueuePool
+from prompy.threadio.scheduling import Scheduler
+from prompy.timers import TimerHandle, TimerService
 
 threads = []
-_prom_pool.on_thread_stop(lambda e: threads.append(e))
+get_pool().on_thread_stop(lambda e: threads.append(e))
 
 
 def threaded_test(func):
@@ -15,7 +33,7 @@ def threaded_test(func):
     def _wrap(*args, **kwargs):
         global threads
         r = func(*args, **kwargs)
-        while _prom_pool.is_running():
+        while get_pool().is_running():
             time.sleep(0.03)
         try:
             for t in threads:
@@ -47,6 +65,615 @@ class TPromiseTest(unittest.TestCase):
         p = piter(lambda x: x + 2, [2, 4, 6], prom_type=TPromise)
         p.then(lambda x: self.assertTrue(x % 2 == 0)).catch(_catch_and_raise)
 
+    @threaded_test
+    def test_pall(self):
+        promises = [TPromise.wrap(lambda x: time.sleep(0.01 * (3 - x)) or x)(i) for i in range(3)]
+        p = pall(*promises, prom_type=TPromise)
+        p.then(lambda x: self.assertEqual([0, 1, 2], x)).catch(_catch_and_raise)
+
+    @threaded_test
+    def test_await_tpromise(self):
+        async def _fan_out():
+            return await asyncio.gather(*(
+                TPromise(lambda resolve, _, x=i: resolve(time.sleep(0.01) or x * 2))
+                for i in range(4)))
+
+        async def _failed():
+            await TPromise(lambda resolve, _: resolve(time.sleep(0.01) or 1 / 0))
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual([0, 2, 4, 6], loop.run_until_complete(_fan_out()))
+            self.assertRaises(ZeroDivisionError, loop.run_until_complete, _failed())
+        finally:
+            loop.close()
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'fork only')
+    def test_tpromise_fork(self):
+        parent_pool = get_pool()
+        results = multiprocessing.get_context('fork').Queue()
+
+        def _child():
+            results.put(get_pool() is not parent_pool)
+            done = threading.Event()
+            TPromise(lambda resolve, _: resolve(os.getpid()),
+                     then=lambda pid: results.put(pid) or done.set())
+            done.wait(2)
+
+        child = multiprocessing.get_context('fork').Process(target=_child)
+        # the module locks are taken during the fork, the child gets new ones.
+        with contextlib.ExitStack() as stack:
+            for lock in (*promise_module._reactions_locks, microtask._loop_queues_lock):
+                stack.enter_context(lock)
+            child.start()
+        child.join(5)
+        self.assertTrue(results.get(timeout=1))
+        self.assertEqual(child.pid, results.get(timeout=1))
+
+    def test_queue_idle_stop(self):
+        stopped = threading.Event()
+        queue = PromiseQueue(start=True, max_idle=0.05, daemon=True,
+                             on_stop=lambda _: stopped.set())
+        self.assertTrue(queue.add_promise(Promise(lambda resolve, _: resolve(1))))
+        self.assertTrue(stopped.wait(1))
+        self.assertTrue(queue.join(1))
+        self.assertFalse(queue.running)
+        late = Promise(lambda resolve, _: resolve(2))
+        self.assertFalse(queue.add_promise(late))
+        self.assertNotIn(late, queue)
+
+        # an idle thread wakes up on stop, not at its idle timeout.
+        queue = PromiseQueue(start=True, max_idle=None, daemon=True)
+        time.sleep(0.02)
+        start = time.monotonic()
+        queue.stop()
+        self.assertTrue(queue.join(1))
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_pool_shared_queue(self):
+        pool = PromiseQueuePool(pool_size=2, start=True, daemon=True)
+        release = threading.Event()
+        done = threading.Event()
+        results = []
+        pool.add_promise(Promise(lambda resolve, _: resolve(release.wait(5))))
+        for i in range(3):
+            pool.add_promise(Promise(lambda resolve, _, x=i: resolve(x),
+                                     then=results.append,
+                                     complete=lambda *_: len(results) == 3 and done.set()))
+        # the short promises are not stuck behind the long one.
+        self.assertTrue(done.wait(1))
+        release.set()
+        self.assertEqual([0, 1, 2], results)
+
+    def test_pool_priority(self):
+        pool = PromiseQueuePool(pool_size=1, daemon=True,
+                                scheduler=Scheduler('priority', aging=None))
+        release = threading.Event()
+        order = []
+        pool.add_promise(Promise(lambda resolve, _: resolve(release.wait(5))))
+        time.sleep(0.02)
+        for priority in (0, 5, 1):
+            pool.add_promise(Promise(lambda resolve, _, x=priority: resolve(order.append(x))),
+                             priority)
+        release.set()
+        time.sleep(0.1)
+        self.assertEqual([5, 1, 0], order)
+
+        # with aging, a long wait makes up for a lower priority.
+        scheduler = Scheduler('priority', aging=0.01)
+        old = scheduler.entry(Promise(None), 0)
+        time.sleep(0.05)
+        self.assertLess(old, scheduler.entry(Promise(None), 2))
+
+    def test_pool_scaling(self):
+        pool = PromiseQueuePool(pool_size=4, min_size=1, max_idle=0.05,
+                                start=True, daemon=True)
+        self.assertEqual(1, pool.stats().workers)
+        release = threading.Event()
+        for _ in range(4):
+            pool.add_promise(Promise(lambda resolve, _: resolve(release.wait(5))))
+        time.sleep(0.05)
+        self.assertEqual(4, pool.stats().workers)
+        release.set()
+        time.sleep(0.5)
+        stats = pool.stats()
+        self.assertEqual(1, stats.workers)
+        self.assertEqual(3, stats.threads_stopped)
+
+    def test_pool_concurrent_submit(self):
+        # the workers retire between the bursts while the producers add without the pool lock.
+        pool = PromiseQueuePool(pool_size=4, max_idle=0.001, start=True, daemon=True)
+        results = []
+        done = threading.Event()
+        total = 8 * 200
+
+        def _produce(base):
+            for i in range(200):
+                pool.add_promise(Promise(lambda resolve, _, x=base + i: resolve(x),
+                                         then=results.append,
+                                         complete=lambda *_: len(results) == total and done.set()))
+                if i % 50 == 0:
+                    time.sleep(0.005)
+
+        producers = [threading.Thread(target=_produce, args=(n * 200,)) for n in range(8)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        self.assertTrue(done.wait(5))
+        self.assertEqual(list(range(total)), sorted(results))
+        time.sleep(0.05)
+        self.assertEqual(0, len(pool._promises))
+
+    def test_pool_limits(self):
+        def _blocked(limits, scheduler=None):
+            pool = PromiseQueuePool(pool_size=1, daemon=True, limits=limits, scheduler=scheduler)
+            release = threading.Event()
+            pool.add_promise(Promise(lambda resolve, _: resolve(release.wait(5))))
+            time.sleep(0.02)
+            return pool, release
+
+        def _noop(resolve, _):
+            resolve(None)
+
+        pool, release = _blocked(QueueLimits(1, 'reject'))
+        pool.add_promise(Promise(_noop))
+        refused = Promise(_noop)
+        self.assertRaises(PromiseOverloadError, pool.add_promise, refused)
+        self.assertTrue(refused.canceled)
+        release.set()
+
+        pool, release = _blocked(QueueLimits(1, 'block', block_timeout=0.01))
+        pool.add_promise(Promise(_noop))
+        self.assertRaises(PromiseOverloadError, pool.add_promise, Promise(_noop))
+        release.set()
+
+        pool, release = _blocked(QueueLimits(2, 'drop_oldest'), Scheduler('priority', aging=None))
+        low, high, new = Promise(_noop), Promise(_noop), Promise(_noop)
+        pool.add_promise(low, 0)
+        pool.add_promise(high, 2)
+        pool.add_promise(new, 1)
+        self.assertEqual(PromiseState.rejected, low.state)
+        self.assertIsInstance(low.error, PromiseOverloadError)
+        release.set()
+        time.sleep(0.05)
+        self.assertEqual(PromiseState.fulfilled, high.state)
+        self.assertEqual(PromiseState.fulfilled, new.state)
+
+        # canceled in the queue, the slots are free right away.
+        pool, release = _blocked(QueueLimits(2, 'reject'))
+        canceled = [Promise(_noop), Promise(_noop)]
+        pool.add_promises(*canceled)
+        for promise in canceled:
+            promise.cancel()
+        self.assertEqual(1, len(pool._promises))
+        queued = [Promise(_noop), Promise(_noop)]
+        pool.add_promises(*queued)
+        release.set()
+        time.sleep(0.05)
+        self.assertEqual([PromiseState.fulfilled] * 2, [p.state for p in queued])
+        self.assertEqual([PromiseState.rejected] * 2, [p.state for p in canceled])
+
+        pool, release = _blocked(QueueLimits(max_wait=0.01))
+        shed = Promise(_noop)
+        pool.add_promise(shed)
+        time.sleep(0.02)
+        release.set()
+        time.sleep(0.05)
+        self.assertIsInstance(shed.error, PromiseOverloadError)
+
+    def test_pool_release(self):
+        pool = PromiseQueuePool(pool_size=1, start=True, daemon=True)
+        done = Promise(lambda resolve, _: resolve(1))
+        pending = Promise.deferred()
+        later_settled = Promise(lambda resolve, _: pending.then(resolve))
+        pool.add_promises(done, later_settled)
+        time.sleep(0.05)
+        self.assertNotIn(done, pool)
+        self.assertIn(later_settled, pool)
+        pending.resolve(2)
+        time.sleep(0.05)
+        self.assertNotIn(later_settled, pool)
+        self.assertEqual(2, later_settled.result)
+
+    def test_pool_shutdown(self):
+        pool = PromiseQueuePool(pool_size=2, daemon=True, scheduler=Scheduler('priority'))
+        results = []
+        for i in range(6):
+            pool.add_promise(Promise(lambda resolve, _, x=i: resolve(time.sleep(0.01) or x),
+                                     then=results.append), i)
+        report = pool.shutdown(timeout=5)
+        self.assertTrue(report.drained)
+        self.assertEqual(6, len(results))
+        self.assertFalse(pool.is_running())
+        refused = Promise(lambda resolve, _: resolve(1))
+        self.assertRaises(PromiseCanceledError, pool.add_promise, refused)
+        self.assertTrue(refused.canceled)
+
+        pool = PromiseQueuePool(pool_size=1, daemon=True)
+        release = threading.Event()
+        pool.add_promise(Promise(lambda resolve, _: resolve(release.wait(5))))
+        queued = Promise(lambda resolve, _: resolve(1))
+        pool.add_promise(queued)
+        time.sleep(0.02)
+        report = pool.shutdown(timeout=0.05)
+        release.set()
+        self.assertEqual((queued,), report.canceled)
+        self.assertEqual(1, report.unjoined)
+        self.assertIsInstance(queued.error, PromiseCanceledError)
+
+    def test_executor(self):
+        pool = PromiseQueuePool(pool_size=2, start=True, daemon=True)
+        with PromiseExecutor(pool) as executor:
+            self.assertEqual(4, executor.submit(pow, 2, 2).result(1))
+            self.assertEqual([x * 2 for x in range(10)],
+                             list(executor.map(lambda x: x * 2, range(10), chunksize=3)))
+            failed = executor.submit(lambda: 1 / 0)
+            self.assertIsInstance(failed.exception(1), ZeroDivisionError)
+            release = threading.Event()
+            executor.submit(release.wait, 5)
+            executor.submit(release.wait, 5)
+            queued = executor.submit(pow, 2, 3)
+            self.assertTrue(queued.cancel())
+            release.set()
+        self.assertTrue(queued.cancelled())
+        self.assertRaises(RuntimeError, executor.submit, pow, 2, 2)
+
+        deferred = Promise.deferred()
+        future = to_future(deferred)
+        deferred.resolve(3)
+        self.assertEqual(3, future.result(1))
+
+        source = concurrent.futures.Future()
+        promise = from_future(source)
+        promise.cancel()
+        self.assertTrue(source.cancelled())
+
+        thread_promise = Promise(lambda resolve, _: resolve(5))
+        pool.add_promise(thread_promise)
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(5, loop.run_until_complete(
+                to_asyncio_future(thread_promise, loop)))
+        finally:
+            loop.close()
+
+    def test_pmap(self):
+        pool = PromiseQueuePool(pool_size=4, start=True, daemon=True)
+        results = []
+        done = threading.Event()
+        in_flight = [0, 0]
+        lock = threading.Lock()
+
+        def work(x):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.001 * (x % 3))
+            with lock:
+                in_flight[0] -= 1
+            return x
+
+        p = pmap(work, iter(range(100)), concurrency=3, container=pool,
+                 on_done=lambda _: done.set())
+        p.then(results.append).catch(_catch_and_raise)
+        p.exec()
+        self.assertTrue(done.wait(10))
+        self.assertEqual(list(range(100)), results)
+        self.assertLessEqual(in_flight[1], 3)
+
+        # a stuck first item, the results after it are not all buffered.
+        release = threading.Event()
+        taken = []
+        done.clear()
+        results = []
+
+        def items():
+            for x in range(100):
+                taken.append(x)
+                yield x
+
+        p = pmap(lambda x: x or release.wait(5) and 0, items(), concurrency=2,
+                 container=pool, on_done=lambda _: done.set())
+        p.then(results.append)
+        p.exec()
+        time.sleep(0.1)
+        self.assertLessEqual(len(taken), 4)
+        release.set()
+        self.assertTrue(done.wait(10))
+        self.assertEqual(list(range(100)), results)
+
+
+class PromiseTest(unittest.TestCase):
+
+    def test_compact_promise(self):
+        p1 = Promise(lambda resolve, _: resolve(1))
+        p2 = Promise(lambda resolve, _: [resolve(x) for x in range(3)])
+        self.assertLess(p1.serial, p2.serial)
+        self.assertFalse(hasattr(p1, '__dict__'))
+        self.assertIsNone(p1._promise_id)
+        self.assertEqual(p1.id, p1.id)
+        p1.exec()
+        p2.exec()
+        self.assertEqual(1, p1.result)
+        self.assertEqual((0, 1, 2), p2.result)
+
+    def test_then_chain(self):
+        results = []
+        p = Promise(lambda resolve, _: resolve(1))
+        chained = p
+        for _ in range(10000):
+            chained = chained.then(lambda x: x + 1)
+        chained.then(results.append)
+
+        def _fail(x):
+            raise Exception(f'failed {x}')
+
+        caught = p.then(_fail).then(lambda x: x * 1000).catch(lambda err: str(err))
+        caught.then(results.append)
+        self.assertEqual([], results)
+        p.exec()
+        self.assertCountEqual([10001, 'failed 1'], results)
+        self.assertIsNot(p, chained)
+        # Already settled promises call the callbacks right away.
+        p.then(results.append)
+        self.assertEqual(1, results[-1])
+
+    def test_then_adopt_promise(self):
+        results = []
+        p = Promise(lambda resolve, _: resolve(2))
+        p.then(lambda x: Promise(lambda resolve, _: resolve(x * 2), start_now=True))\
+            .then(results.append)
+        p.exec()
+        self.assertEqual([4], results)
+
+    def test_unhandled_rejection(self):
+        def _fail(_, __):
+            raise Exception('unhandled')
+
+        p = Promise(_fail)
+        p.then(lambda x: x)
+        with self.assertRaises(UnhandledPromiseError):
+            p.exec()
+
+    def test_combinators(self):
+        results = []
+        error = Exception('rejected')
+
+        def _reject(_, reject):
+            reject(error)
+
+        def _promises():
+            return [Promise(lambda resolve, _: resolve(1)),
+                    Promise(_reject),
+                    Promise(lambda resolve, _: resolve(3))]
+
+        promises = _promises()
+        settled = pall_settled(*promises, start_now=True)
+        settled.then(results.append)
+        for p in reversed(promises):
+            p.exec()
+        self.assertEqual([PromiseState.fulfilled, PromiseState.rejected, PromiseState.fulfilled],
+                         [x.state for x in results[0]])
+        self.assertEqual(3, results[0][2].result)
+        self.assertIs(error, results[0][1].error)
+
+        promises = _promises()
+        pall(*promises, start_now=True).catch(results.append)
+        prace(*promises, start_now=True).then(results.append)
+        pany(*promises[1:], start_now=True).then(results.append)
+        for p in promises[::-1]:
+            p.exec()
+        self.assertCountEqual([error, 3, 3], results[1:])
+
+        p = Promise(_reject)
+        pany(p, start_now=True).catch(results.append)
+        p.exec()
+        self.assertIsInstance(results[-1], PromiseAggregateError)
+        self.assertEqual([error], results[-1].errors)
+
+        pall(start_now=True).then(results.append)
+        self.assertEqual([], results[-1])
+
+    def test_promise_cache(self):
+        calls = []
+        results = []
+
+        @promise_cache(maxsize=2)
+        @promise_wrap
+        def double(x):
+            calls.append(x)
+            return x * 2
+
+        first = double(1)
+        joined = double(1)
+        first.exec()
+        joined.then(results.append)
+        double(1).then(results.append)
+        for x in (2, 3):
+            double(x).exec()
+        double(1).exec()
+        self.assertEqual([2, 2], results)
+        self.assertEqual([1, 2, 3, 1], calls)
+        info = double.cache_info()
+        self.assertEqual((1, 4, 1, 2), (info.hits, info.misses, info.joined, info.size))
+
+        # func is called without the lock, it can call the cache.
+        @promise_cache
+        def fib(n):
+            if n < 2:
+                return Promise(lambda resolve, _: resolve(n), start_now=True)
+            return pall(fib(n - 1), fib(n - 2), start_now=True).then(sum)
+
+        fib(15).then(results.append)
+        self.assertEqual(610, results[-1])
+        self.assertEqual(16, fib.cache_info().misses)
+
+    def test_batcher(self):
+        batches = []
+        results = []
+
+        def load(keys):
+            batches.append(keys)
+            return {k: KeyError(k) if k < 0 else k * 2 for k in keys}
+
+        batcher = PromiseBatcher(load, max_batch_size=3, window=0)
+        for key in (1, 1, -1):
+            batcher.load(key).then(results.append).catch(lambda e: results.append(str(e)))
+        batcher.dispatch()
+        batcher.load_many([5, 4]).then(results.append)
+        self.assertEqual([[1, -1]], batches)
+        # full batches are dispatched right away.
+        batcher.load(6).then(results.append)
+        self.assertEqual([[1, -1], [5, 4, 6]], batches)
+        self.assertCountEqual([2, 2, '-1', 12, [10, 8]], results)
+
+        # the window expires on the timer thread, the batch runs elsewhere.
+        threads = []
+        done = threading.Event()
+
+        def load_window(keys):
+            threads.append(threading.current_thread().name)
+            return keys
+
+        windowed = PromiseBatcher(load_window, window=0.01)
+        windowed.load(7).then(lambda _: done.set())
+        self.assertTrue(done.wait(1))
+        self.assertNotIn(threads[0], ('PromiseTimer', 'PromiseHandoff'))
+
+    def test_timers(self):
+        results = []
+        done = threading.Event()
+        p = later(lambda x: x * 2, 0.02)(4)
+        p.then(results.append)
+        p.exec()
+        ptimeout(Promise.deferred(), 0.01).catch(results.append)
+        ticks = pinterval(lambda: 'tick', 0.01, count=3)
+        ticks.complete(lambda *_: len(ticks.result) == 3 and done.set())
+        ticks.exec()
+        self.assertTrue(done.wait(1))
+        time.sleep(0.05)
+        self.assertEqual(8, results[1])
+        self.assertIsInstance(results[0], PromiseTimeoutError)
+        self.assertEqual(('tick',) * 3, ticks.result)
+
+        # slow timer functions don't delay the deadlines.
+        errors = []
+        slow = later(time.sleep, 0.01)(0.5)
+        slow.exec()
+        slow_ticks = pinterval(lambda: time.sleep(0.5), 0.01, count=1)
+        slow_ticks.exec()
+        deadline = Promise(lambda resolve, _: None, timeout=0.1)
+        deadline.catch(errors.append)
+        deadline.exec()
+        time.sleep(0.3)
+        self.assertIsInstance(deadline.error, PromiseTimeoutError)
+        # the catch waits for a thread of the pool.
+        time.sleep(0.5)
+        self.assertIsInstance(errors[0], PromiseTimeoutError)
+
+        # canceled while the timer thread reads it, the call is made or not, never half canceled.
+        errors = []
+        calls = []
+        reading = threading.Event()
+        canceled = threading.Event()
+
+        class _ReadHandle(TimerHandle):
+            __slots__ = ()
+
+            @property
+            def func(self):
+                func = TimerHandle.func.__get__(self)
+                reading.set()
+                canceled.wait(0.2)
+                return func
+
+            @func.setter
+            def func(self, value):
+                TimerHandle.func.__set__(self, value)
+
+        service = TimerService('TimerRace', on_error=errors.append)
+        handle = service.call_later(0.05, calls.append, 'raced')
+        handle.__class__ = _ReadHandle
+        self.assertTrue(reading.wait(1))
+        handle.cancel()
+        canceled.set()
+        time.sleep(0.05)
+        self.assertEqual([], errors)
+        self.assertEqual(['raced'], calls)
+
+        # started again while the stopped thread is exiting, one thread runs the timers.
+        service.stop()
+        service.call_later(0.01, calls.append, 'restarted')
+        time.sleep(0.05)
+        self.assertEqual(1, sum(t.name == 'TimerRace' for t in threading.enumerate()))
+        self.assertEqual(1, calls.count('restarted'))
+
+    def test_timeout(self):
+        errors = []
+        started = []
+        p = Promise(lambda resolve, _: started.append(resolve), timeout=0.01)
+        p.catch(errors.append)
+        p.exec()
+        fast = Promise(lambda resolve, _: resolve(1), timeout=0.01, start_now=True)
+        time.sleep(0.05)
+        started[0]('late')
+        self.assertIsInstance(errors[0], PromiseTimeoutError)
+        self.assertEqual(PromiseState.rejected, p.state)
+        self.assertIsNone(p.result)
+        self.assertEqual(1, fast.result)
+        # expired before it was started, not executed.
+        late = Promise(lambda resolve, _: started.append(resolve), timeout=0)
+        late.catch(errors.append)
+        time.sleep(0.02)
+        late.exec()
+        self.assertTrue(late.canceled)
+        self.assertEqual(1, len(started))
+
+        # a slow reaction to a timeout does not delay the next deadlines.
+        start = time.monotonic()
+        expired = []
+        slow = Promise(lambda resolve, _: None, timeout=0.01)
+        slow.catch(lambda _: time.sleep(1))
+        slow.exec()
+        other = Promise(lambda resolve, _: None, timeout=0.1)
+        other.catch(lambda _: expired.append(time.monotonic() - start))
+        other.exec()
+        time.sleep(0.3)
+        self.assertEqual(1, len(expired))
+        self.assertLess(expired[0], 0.3)
+
+    def test_cancel(self):
+        errors = []
+        token = CancelToken()
+        resolvers = []
+        first = Promise(lambda resolve, _: resolvers.append(resolve), start_now=True)
+        second = Promise(lambda resolve, _: resolve(2), cancel_token=token)
+        chained = first.then(lambda x: x + 1)
+        chained.catch(errors.append)
+        combined = pall(first, second)
+        combined.catch(errors.append)
+        combined.cancel('stop')
+        self.assertTrue(first.canceled and second.canceled)
+        resolvers[0](1)
+        second.exec()
+        self.assertIsNone(first.result)
+        self.assertIsNone(second.result)
+        self.assertEqual(2, len(errors))
+        self.assertIsInstance(errors[0], PromiseCanceledError)
+        self.assertEqual('stop', errors[0].reason)
+        # the queue skip canceled promises.
+        child = CancelToken(token)
+        token.cancel()
+        self.assertTrue(child.canceled)
+        queued = []
+        pool = PromiseQueuePool(pool_size=1, start=True, daemon=True)
+        p = Promise(lambda resolve, _: queued.append(1), cancel_token=child)
+        pool.add_promise(p)
+        pool.add_promise(Promise(lambda resolve, _: queued.append(2)))
+        time.sleep(0.1)
+        self.assertEqual([2], queued)
+
 
 if __name__ == '__main__':
     unittest.main()